@@ -0,0 +1,372 @@
+# benchmark.py
+"""
+Hardware-free benchmark of the control pipeline.
+
+Runs ControlPipeline end to end with a recorded video, an image sequence
+or blank frames standing in for the camera, a local mock of the detection
+API, and a simulated gantry that takes as long as the real one would.
+Pads whose phone has charged for --charge-time seconds get a red light
+painted into the replayed frames, so retrieval is exercised too.
+
+    python benchmark.py --source table.mp4 --duration 120 --latency 0.4
+    python benchmark.py --phone 300,400 --phone 600,900 --json run.json
+"""
+import argparse
+import functools
+import glob
+import json
+import logging
+import os
+import random
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import cv2
+import numpy as np
+
+from capture import FrameGrabber
+from change_gate import ChangeGate
+from detection import DetectionClient, Detector, RemoteBackend
+from detection_cache import DetectionCache
+from gantry import Gantry
+from motion_executor import MotionExecutor
+from pipeline import ControlPipeline, image_slots
+from preprocess import RoiPreprocessor
+from red_light import RedLightMonitor
+from step_backends import SimulatedStepBackend
+from table_state import TableState
+from tracker import PhoneTracker
+
+log = logging.getLogger("benchmark")
+
+
+class ReplayCapture:
+    """
+    Stands in for cv2.VideoCapture. source is a video file, a directory or
+    glob of images (played in name order), or None for blank frames of
+    `size`. Frames are delivered at `fps` in real time and the recording
+    loops unless loop=False. paint(frame), if given, may draw on every
+    frame before it is returned.
+    """
+
+    IMAGE_TYPES = (".png", ".jpg", ".jpeg", ".bmp")
+
+    def __init__(self, source=None, fps=30.0, loop=True, size=(1920, 1080), paint=None):
+        self.fps = fps
+        self.loop = loop
+        self.paint = paint
+        self.video = None
+        self.images = None
+        self.blank = None
+        if source is None:
+            self.blank = np.zeros((size[1], size[0], 3), np.uint8)
+        elif os.path.isdir(source) or glob.has_magic(source):
+            pattern = os.path.join(source, "*") if os.path.isdir(source) else source
+            self.images = sorted(p for p in glob.glob(pattern)
+                                 if p.lower().endswith(self.IMAGE_TYPES))
+            if not self.images:
+                raise ValueError(f"No images found for {source}.")
+        else:
+            self.video = cv2.VideoCapture(source)
+        self._index = 0
+        self._frame = None
+        self._next_time = time.perf_counter()
+        self._opened = self.video.isOpened() if self.video is not None else True
+
+    def isOpened(self):
+        return self._opened
+
+    def _next(self):
+        if self.blank is not None:
+            return self.blank.copy()
+        if self.images is not None:
+            if self._index >= len(self.images):
+                if not self.loop:
+                    return None
+                self._index = 0
+            frame = cv2.imread(self.images[self._index])
+            self._index += 1
+            return frame
+        ret, frame = self.video.read()
+        if not ret and self.loop:
+            self.video.set(cv2.CAP_PROP_POS_FRAMES, 0)
+            ret, frame = self.video.read()
+        return frame if ret else None
+
+    def grab(self):
+        # Hold frames back to the recording's frame rate
+        delay = self._next_time - time.perf_counter()
+        if delay > 0:
+            time.sleep(delay)
+        self._next_time = max(self._next_time + 1.0 / self.fps, time.perf_counter())
+        self._frame = self._next()
+        if self._frame is None:
+            self._opened = False
+            return False
+        if self.paint is not None:
+            self.paint(self._frame)
+        return True
+
+    def retrieve(self, image=None):
+        if self._frame is None:
+            return False, None
+        if image is not None and image.shape == self._frame.shape:
+            np.copyto(image, self._frame)
+            return True, image
+        return True, self._frame
+
+    def read(self, image=None):
+        if not self.grab():
+            return False, None
+        return self.retrieve(image)
+
+    def release(self):
+        if self.video is not None:
+            self.video.release()
+        self._opened = False
+
+
+class MockDetectionServer:
+    """
+    Local stand-in for the detection API. Every POST is answered after
+    latency +/- jitter seconds with the same phones, given as table-space
+    centres; scale maps them into the uploaded image (the encoder's
+    downscale factor) so the client's rescaling lands them back in place.
+    """
+
+    def __init__(self, phones, latency=0.3, jitter=0.0, scale=1.0, box_size=(70, 140),
+                 host="127.0.0.1", port=0):
+        self.phones = [tuple(p) for p in phones]
+        self.latency = latency
+        self.jitter = jitter
+        self.scale = scale
+        self.box_size = box_size
+        self.requests = 0
+        self._lock = threading.Lock()
+        self._server = ThreadingHTTPServer((host, port), self._handler())
+        self._thread = None
+
+    @property
+    def url(self):
+        host, port = self._server.server_address[:2]
+        return f"http://{host}:{port}/detect"
+
+    def response(self):
+        w, h = self.box_size
+        phones = []
+        for x, y in self.phones:
+            x, y = x * self.scale, y * self.scale
+            half_w, half_h = w * self.scale / 2, h * self.scale / 2
+            phones.append({
+                "coordinates": {"x1": x - half_w, "y1": y - half_h, "x2": x + half_w, "y2": y + half_h},
+                "center": {"x": x, "y": y},
+                "confidence": 0.9,
+            })
+        return {"phones": phones}
+
+    def _handler(self):
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"  # keep-alive, like the real API
+
+            def do_POST(self):
+                self.rfile.read(int(self.headers.get("Content-Length", 0)))
+                with server._lock:
+                    server.requests += 1
+                time.sleep(max(server.latency + random.uniform(-server.jitter, server.jitter), 0))
+                body = json.dumps(server.response()).encode()
+                self.send_response(200)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, *args):
+                pass
+
+        return Handler
+
+    def start(self):
+        self._thread = threading.Thread(target=self._server.serve_forever,
+                                        name="mock-detection-api", daemon=True)
+        self._thread.start()
+        return self.url
+
+    def stop(self):
+        self._server.shutdown()
+        self._server.server_close()
+
+
+class TimedDetector:
+    """
+    Wraps a Detector and records how long each frame sent to a backend took.
+    Frames the change gate held back and cache hits answer without one and
+    are left out; the cache reports its hits itself (DetectionCache.stats()).
+    """
+
+    def __init__(self, detector):
+        self.detector = detector
+        self.latencies = []
+
+    def submit(self, frame=None, **kwargs):
+        start = time.perf_counter()
+        # Lookups happen inside submit(), so a change in hits means this frame hit
+        cache = self.detector.cache
+        hits = cache.hits if cache is not None else 0
+        pending = self.detector.submit(frame, **kwargs)
+        if pending is not None and (cache is None or cache.hits == hits):
+            pending.add_done_callback(functools.partial(self._finished, start))
+        return pending
+
+    def _finished(self, start, future):
+        if not future.cancelled() and future.exception() is None and future.result()[0] is not None:
+            self.latencies.append(time.perf_counter() - start)  # not held back by the change gate
+
+    def __getattr__(self, name):
+        return getattr(self.detector, name)
+
+
+class BenchmarkTable(TableState):
+    """TableState that records when pads are placed and returned."""
+
+    def __init__(self, pad_coords, **kwargs):
+        super().__init__(pad_coords, **kwargs)
+        self.placed_at = {}
+        self.placements = []
+        self.returns = []
+
+    def mark_placed(self, track_id, pad_index):
+        super().mark_placed(track_id, pad_index)
+        now = time.perf_counter()
+        self.placed_at[track_id] = now
+        self.placements.append(now)
+
+    def mark_returned(self, track_id, pad_index):
+        super().mark_returned(track_id, pad_index)
+        self.placed_at.pop(track_id, None)
+        self.returns.append(time.perf_counter())
+
+
+def charge_painter(table, preprocessor, charge_time, radius=6):
+    """paint() hook lighting a pad's red light once it has charged for charge_time seconds."""
+
+    def paint(frame):
+        now = time.perf_counter()
+        for track_id, (position, _) in table.placed().items():
+            placed_at = table.placed_at.get(track_id)
+            if placed_at is not None and now - placed_at >= charge_time:
+                x, y = preprocessor.to_frame(*position)
+                cv2.circle(frame, (int(x), int(y)), radius, (0, 0, 255), -1)
+
+    return paint
+
+
+def percentiles(values, points=(50, 90, 99)):
+    if not values:
+        return {f"p{p}": None for p in points}
+    return {f"p{p}": float(v) for p, v in zip(points, np.percentile(values, points))}
+
+
+def run(source=None, fps=30.0, loop=True, duration=60.0, phones=((300, 400),), latency=0.3,
+        jitter=0.0, charge_time=5.0, time_scale=1.0):
+    """Run the pipeline for `duration` seconds and return a report dict."""
+    preprocessor = RoiPreprocessor(slots=image_slots())
+    width, height = preprocessor.width, preprocessor.height
+    table = BenchmarkTable([(0, 0), (width - 1, 0), (0, height - 1), (width - 1, height - 1)])
+
+    # The report only needs step counts and the clock, not every pulse
+    backend = SimulatedStepBackend(time_scale=time_scale, record_pulses=False)
+    gantry = Gantry(backend=backend)
+    executor = MotionExecutor(gantry)
+    cache = DetectionCache()
+    executor.add_listener(cache.invalidate)
+
+    client = DetectionClient(url="http://127.0.0.1/detect")
+    remote = RemoteBackend(client)
+    max_side = remote.encoder.max_side
+    scale = min(1.0, max_side / max(width, height)) if max_side else 1.0
+    server = MockDetectionServer(phones, latency=latency, jitter=jitter, scale=scale)
+    client.url = server.start()
+    detector = TimedDetector(Detector(client=client, gate=ChangeGate(), backends=[remote],
+                                      preprocessor=preprocessor, cache=cache))
+
+    capture = ReplayCapture(source, fps=fps, loop=loop,
+                            paint=charge_painter(table, preprocessor, charge_time))
+    grabber = FrameGrabber(None, capture=capture)
+    if not grabber.start():
+        raise RuntimeError(f"Cannot read from {source}.")
+
+    pipeline = ControlPipeline(grabber, preprocessor, detector, PhoneTracker(), RedLightMonitor(),
+                               executor, gantry, table, show=False)
+    start = time.perf_counter()
+    pipeline.start()
+    try:
+        while time.perf_counter() - start < duration and not pipeline.stopped.is_set():
+            if not capture.isOpened():
+                break
+            time.sleep(0.1)
+    finally:
+        elapsed = time.perf_counter() - start
+        pipeline.stop()
+        executor.shutdown(wait=False)
+        grabber.release()
+        server.stop()
+        client.close()
+    if pipeline.error is not None:
+        raise pipeline.error
+
+    motion = backend.clock_ns / 1e9 * time_scale
+    return {
+        "duration_s": elapsed,
+        "frames": grabber.frame_count,
+        "dropped_frames": pipeline.to_detect.dropped + pipeline.to_monitor.dropped,
+        "api_requests": server.requests,
+        "detections": len(detector.latencies),
+        "detection_latency_s": percentiles(detector.latencies),
+        "detection_cache": cache.stats(),
+        "pads_placed": len(table.placements),
+        "pads_returned": len(table.returns),
+        "phones_per_minute": len(table.placements) / elapsed * 60 if elapsed else 0.0,
+        "gantry_motion_s": motion,
+        "gantry_busy": motion / elapsed if elapsed else 0.0,
+        "steps_per_pin": dict(backend.step_counts),
+    }
+
+
+def point(text):
+    x, y = text.split(",")
+    return float(x), float(y)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--source", help="video file, image directory or glob; blank frames if omitted")
+    parser.add_argument("--fps", type=float, default=30.0)
+    parser.add_argument("--no-loop", action="store_true", help="stop at the end of the recording")
+    parser.add_argument("--duration", type=float, default=60.0, help="seconds to run")
+    parser.add_argument("--phone", type=point, action="append",
+                        help="table-space x,y of a phone the mock API reports (repeatable)")
+    parser.add_argument("--latency", type=float, default=0.3, help="mock API latency (s)")
+    parser.add_argument("--jitter", type=float, default=0.0, help="mock API latency jitter (s)")
+    parser.add_argument("--charge-time", type=float, default=5.0,
+                        help="seconds before a placed pad's red light comes on")
+    parser.add_argument("--time-scale", type=float, default=1.0,
+                        help="gantry moves take this fraction of their real time")
+    parser.add_argument("--json", help="also write the report to this file")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.WARNING)
+    report = run(source=args.source, fps=args.fps, loop=not args.no_loop,
+                 duration=args.duration, phones=args.phone or [(300, 400)],
+                 latency=args.latency, jitter=args.jitter, charge_time=args.charge_time,
+                 time_scale=args.time_scale)
+    print(json.dumps(report, indent=2))
+    if args.json:
+        with open(args.json, "w") as out:
+            json.dump(report, out, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,116 @@
+# capture.py
+import threading
+import time
+
+import cv2
+import numpy as np
+
+from metrics import metrics
+
+
+class FrameGrabber:
+    """
+    Reads the camera on a dedicated thread into a small ring of preallocated
+    frame buffers, so the driver queue is drained continuously and callers
+    always get the newest frame without blocking on the device.
+
+    read() returns (ok, frame, timestamp) like cv2.VideoCapture.read() plus
+    the perf_counter time the frame was grabbed. The returned frame is a
+    slot in the ring and is overwritten after `slots - 1` further frames;
+    pass copy=True to keep it longer.
+    """
+
+    def __init__(self, source, slots=3, capture=None):
+        self.cap = capture if capture is not None else cv2.VideoCapture(source)
+        self.slots = slots
+        self._buffers = None
+        self._index = -1
+        self._timestamp = None
+        self._seq = 0
+        self._failures = 0
+        self._cond = threading.Condition()
+        self._stopped = False
+        self._thread = None
+        self._capture = metrics.timer("capture", "Grabbing and decoding one camera frame")
+        self._failed = metrics.counter("capture_failures_total", "Camera grabs that failed")
+
+    def isOpened(self):
+        return self.cap.isOpened()
+
+    def start(self):
+        ret, frame = self.cap.read()
+        if not ret:
+            return False
+        self._buffers = [np.empty_like(frame) for _ in range(self.slots)]
+        np.copyto(self._buffers[0], frame)
+        self._publish(0, time.perf_counter())
+        self._thread = threading.Thread(target=self._run, name="frame-grabber", daemon=True)
+        self._thread.start()
+        return True
+
+    def _publish(self, index, timestamp):
+        with self._cond:
+            self._index = index
+            self._timestamp = timestamp
+            self._seq += 1
+            self._cond.notify_all()
+
+    def _run(self):
+        index = 0
+        while not self._stopped:
+            # grab() + retrieve() decodes straight into the next free slot
+            start = time.perf_counter()
+            if not self.cap.grab():
+                self._failures += 1
+                self._failed.inc()
+                time.sleep(0.01)
+                continue
+            timestamp = time.perf_counter()
+            index = (index + 1) % self.slots
+            ret, frame = self.cap.retrieve(self._buffers[index])
+            if not ret:
+                self._failures += 1
+                self._failed.inc()
+                continue
+            self._capture.observe(time.perf_counter() - start)
+            if frame is not self._buffers[index]:
+                np.copyto(self._buffers[index], frame)
+            self._publish(index, timestamp)
+
+    def read(self, copy=False):
+        with self._cond:
+            if self._index < 0:
+                return False, None, None
+            frame = self._buffers[self._index]
+            timestamp = self._timestamp
+        return True, (frame.copy() if copy else frame), timestamp
+
+    def read_newer(self, since, timeout=1.0, copy=False):
+        """
+        Wait for a frame grabbed after `since` (a perf_counter time). On
+        timeout returns (False, None, since) so the caller can retry.
+        """
+        deadline = time.perf_counter() + timeout
+        with self._cond:
+            while self._timestamp is None or self._timestamp <= since:
+                remaining = deadline - time.perf_counter()
+                if remaining <= 0 or self._stopped:
+                    return False, None, since
+                self._cond.wait(remaining)
+        return self.read(copy=copy)
+
+    @property
+    def frame_count(self):
+        return self._seq
+
+    @property
+    def failures(self):
+        return self._failures
+
+    def release(self):
+        self._stopped = True
+        with self._cond:
+            self._cond.notify_all()
+        if self._thread is not None:
+            self._thread.join()
+        self.cap.release()
@@ -0,0 +1,77 @@
+# change_gate.py
+import time
+
+import cv2
+import numpy as np
+
+from config import (GATE_SCALE, GATE_GRID, GATE_PIXEL_THRESHOLD, GATE_REGION_FRACTION,
+                    GATE_LEARNING_RATE, GATE_MAX_AGE)
+
+
+class ChangeGate:
+    """
+    Cheap local check for whether the table changed since the last frame
+    the detection API actually saw.
+
+    Frames are reduced to a small grayscale thumbnail and compared with a
+    reference thumbnail per grid cell. A cell counts as changed when more
+    than region_fraction of its pixels differ by more than pixel_threshold;
+    any changed cell lets the frame through. While nothing changes the
+    reference slowly follows the scene (learning_rate) to absorb lighting
+    drift, and a frame is let through anyway every max_age seconds.
+    """
+
+    def __init__(self, scale=GATE_SCALE, grid=GATE_GRID, pixel_threshold=GATE_PIXEL_THRESHOLD,
+                 region_fraction=GATE_REGION_FRACTION, learning_rate=GATE_LEARNING_RATE,
+                 max_age=GATE_MAX_AGE):
+        self.scale = scale
+        self.grid = grid
+        self.pixel_threshold = pixel_threshold
+        self.region_fraction = region_fraction
+        self.learning_rate = learning_rate
+        self.max_age = max_age
+        self.reference = None
+        self.reference_time = 0.0
+        self.checked = 0
+        self.skipped = 0
+
+    def thumbnail(self, roi: np.ndarray) -> np.ndarray:
+        small = cv2.resize(roi, None, fx=self.scale, fy=self.scale, interpolation=cv2.INTER_AREA)
+        if small.ndim == 3:
+            small = cv2.cvtColor(small, cv2.COLOR_BGR2GRAY)
+        return small
+
+    def changed_regions(self, thumb: np.ndarray) -> np.ndarray:
+        """Per-cell fraction of changed pixels, shape grid (rows, cols)."""
+        diff = cv2.absdiff(thumb, cv2.convertScaleAbs(self.reference))
+        mask = (diff > self.pixel_threshold).astype(np.float32)
+        rows, cols = self.grid
+        return cv2.resize(mask, (cols, rows), interpolation=cv2.INTER_AREA)
+
+    def check(self, roi: np.ndarray):
+        """
+        Returns (send, thumb). Pass thumb to accept() once the API has
+        answered for this frame, so it becomes the new reference.
+        """
+        self.checked += 1
+        thumb = self.thumbnail(roi)
+        if self.reference is None or self.reference.shape != thumb.shape:
+            return True, thumb
+        if time.perf_counter() - self.reference_time > self.max_age:
+            return True, thumb
+        if (self.changed_regions(thumb) > self.region_fraction).any():
+            return True, thumb
+        cv2.accumulateWeighted(thumb, self.reference, self.learning_rate)
+        self.skipped += 1
+        return False, thumb
+
+    def accept(self, thumb: np.ndarray):
+        self.reference = thumb.astype(np.float32)
+        self.reference_time = time.perf_counter()
+
+    def reset(self):
+        self.reference = None
+
+    @property
+    def skip_rate(self):
+        return self.skipped / self.checked if self.checked else 0.0
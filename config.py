@@ -1,3 +1,5 @@
+from typing import NamedTuple
+
 API_URL = "http://35.196.159.246:8000/detect_phone"  
 API_KEY = "16311"
 
@@ -12,3 +14,125 @@ CAMERA_INDEX = 0
 
 # Detection constraints
 PIXEL_THRESHOLD = 200  # Pixel difference threshold to confirm same phone
+
+# Gantry settle times (s) after each move, replacing the old fixed 1 s sleeps
+MOTION_SETTLE_XY = 0.25
+MOTION_SETTLE_Z = 0.5
+
+# How step pulses are generated (see step_backends.py): "gpio" paces them
+# from Python, sharing the GIL with every other thread; "pigpio" has the
+# pigpio daemon play them out by DMA. A Pi has one pigpio wave transmitter,
+# so at most one table per daemon can use it.
+STEP_BACKEND = "gpio"
+PIGPIO_HOST = "localhost"
+PIGPIO_PORT = 8888
+
+# Detection API client
+API_TIMEOUT = 60
+API_POOL_SIZE = 4       # kept-alive connections to API_URL
+API_MAX_IN_FLIGHT = 2   # frames pipelined by Detector.submit
+
+# Local change gate in front of the detection API (see change_gate.py)
+GATE_SCALE = 0.125           # thumbnail scale of the ROI
+GATE_GRID = (8, 8)           # region grid (rows, cols)
+GATE_PIXEL_THRESHOLD = 25    # grayscale difference counted as changed
+GATE_REGION_FRACTION = 0.05  # fraction of a region that must change
+GATE_LEARNING_RATE = 0.02    # reference drift while the table is static
+GATE_MAX_AGE = 10.0          # seconds before a frame is sent regardless
+
+# Detection backends, tried in order until one answers:
+# ("remote", "local") is remote-first, ("local", "remote") local-first
+DETECTION_BACKENDS = ("remote", "local")
+LOCAL_MODEL_PATH = "models/phone_yolo.onnx"
+LOCAL_MODEL_ENGINE = "opencv"    # "opencv" (cv2.dnn) or "onnxruntime"
+LOCAL_MODEL_INPUT_SIZE = 640
+LOCAL_MODEL_CLASS_IDS = (67,)    # COCO "cell phone"; (0,) for a phone-only model
+LOCAL_CONF_THRESHOLD = 0.25
+LOCAL_NMS_THRESHOLD = 0.45
+
+# Upload encoding for the remote detection API (see encoding.py)
+ENCODE_FORMAT = "jpg"          # "jpg" or "webp"
+ENCODE_MAX_SIDE = 640          # downscale to the model input size; 0 keeps full size
+ENCODE_GRAYSCALE = False
+ENCODE_QUALITY = 80            # starting quality, adapted to upload latency
+ENCODE_MIN_QUALITY = 40
+ENCODE_MAX_QUALITY = 90
+ENCODE_TARGET_LATENCY = 0.5    # seconds per request; None/0 disables adaptation
+
+# Camera calibration for undistorting the ROI (see preprocess.py);
+# None skips undistortion. CAMERA_MATRIX is 3x3, DIST_COEFFS (k1, k2, p1, p2[, k3])
+CAMERA_MATRIX = None
+DIST_COEFFS = None
+
+# Red charge-light monitoring around placed pads (see red_light.py)
+RED_LIGHT_THRESHOLD = 30   # pixels between pad centre and light
+RED_LIGHT_DEBOUNCE = 3     # consecutive frames before a pad's state flips
+RED_LIGHT_MIN_AREA = 5     # pixels
+
+# Phone tracking (see tracker.py); PIXEL_THRESHOLD is the association gate
+TRACK_CONFIRM_HITS = 2          # detections before a phone is confirmed
+TRACK_MAX_MISSES = 5            # analysed frames without a match before a track is dropped
+TRACK_PROCESS_NOISE = 50.0      # (px/s^2)^2, how fast a track may change velocity
+TRACK_MEASUREMENT_NOISE = 25.0  # px^2, detector centre jitter
+
+# Control pipeline (see pipeline.py)
+PIPELINE_QUEUE_SIZE = 1           # frames buffered between stages; older ones are dropped
+PIPELINE_CAPTURE_INTERVAL = 0.1   # min seconds between frames fed into the pipeline
+PIPELINE_POLL_INTERVAL = 0.1      # how often idle stages check for shutdown
+PIPELINE_BATCH_WINDOW = 0.2       # wait this long for more jobs before planning a route
+PAD_ZONE_RADIUS = 70              # pixels around a served phone ignored by detection
+
+# Logging and metrics (see metrics.py)
+LOG_LEVEL = "INFO"              # "DEBUG" adds per-phone detection details
+METRICS_ENABLED = False         # off: instrumentation is a no-op
+METRICS_PORT = 9108             # Prometheus text endpoint on localhost; None disables
+METRICS_JSONL_PATH = None       # e.g. "metrics.jsonl"; None disables
+METRICS_JSONL_INTERVAL = 10.0   # seconds between JSON-lines snapshots
+
+# Debug window with annotated detections; off on the headless table
+SHOW_DETECTIONS = False
+
+# Perceptual-hash cache of detection results (see detection_cache.py)
+DETECTION_CACHE_SIZE = 32        # results kept, least recently used evicted first
+DETECTION_CACHE_TTL = 30.0       # seconds a result stays valid; 0 keeps them until evicted
+DETECTION_CACHE_GRID = (8, 8)    # cells (rows, cols), each hashed separately
+DETECTION_CACHE_HASH = "phash"   # "phash" or "dhash"; dHash flips on sensor noise in
+                                 # smooth cells, so it needs a tolerance of about 2
+DETECTION_CACHE_TOLERANCE = 8    # max differing bits (of 64) in any one cell; a
+                                 # phone-sized object flips 14+ in the cells it covers
+
+# Crash-recovery journal of the gantry position and pads (see journal.py)
+JOURNAL_PATH = "{name}.journal"  # per table, {name} being its name; None disables
+                                 # journalling and the controller starts at home
+JOURNAL_SYNC_INTERVAL = 0.5      # max seconds between fsyncs of appended records
+JOURNAL_COMPACT_EVERY = 1000     # records before the journal is rewritten as a snapshot
+
+# Shared detection dispatcher for several tables (see detection_dispatcher.py).
+# Frames from all tables are sent to API_BATCH_URL as one multipart request
+# (one "files" part per image), answered with {"results": [response, ...]}
+# in the same order; a batch of one goes to API_URL as usual. None disables
+# batching, as does the endpoint answering 404 or 405: every frame then goes
+# to API_URL on its own.
+API_BATCH_URL = API_URL + "_batch"
+DISPATCH_MAX_BATCH = 8       # frames per request
+DISPATCH_MAX_DELAY = 0.05    # max seconds the oldest frame waits for a batch to fill
+DISPATCH_MAX_IN_FLIGHT = 2   # batch requests outstanding at once
+
+
+class TableConfig(NamedTuple):
+    """What differs between the tables one controller drives."""
+    name: str
+    camera_index: int = CAMERA_INDEX
+    roi: tuple = (ROI_X1, ROI_Y1, ROI_X2, ROI_Y2)
+    camera_matrix: object = CAMERA_MATRIX
+    dist_coeffs: object = DIST_COEFFS
+    pins: dict = None             # Gantry pin overrides, e.g. {"MOTOR_A_STEP_PIN": 17}
+    step_backend: str = STEP_BACKEND
+    home: tuple = (0, 0)
+    journal_path: str = JOURNAL_PATH
+
+
+# The tables main.py drives, each with its own camera, gantry and journal
+TABLES = (
+    TableConfig("table"),
+)
@@ -2,145 +2,655 @@
 import requests
 import cv2
 import json
+import logging
+import os
+import socket
+import threading
 import time
 import numpy as np
-from config import API_URL, API_KEY, ROI_X1, ROI_Y1, ROI_X2, ROI_Y2
+from concurrent.futures import Future, ThreadPoolExecutor
+from requests.adapters import HTTPAdapter
+from urllib3.connection import HTTPConnection
+from encoding import FrameEncoder
+from metrics import metrics
+from preprocess import RoiPreprocessor
+from config import (API_URL, API_BATCH_URL, API_KEY, API_TIMEOUT, API_POOL_SIZE,
+                    API_MAX_IN_FLIGHT, DETECTION_BACKENDS,
+                    LOCAL_MODEL_PATH, LOCAL_MODEL_ENGINE, LOCAL_MODEL_INPUT_SIZE,
+                    LOCAL_MODEL_CLASS_IDS, LOCAL_CONF_THRESHOLD, LOCAL_NMS_THRESHOLD)
 
-class Detector:
-    def __init__(self):
-        pass
+log = logging.getLogger(__name__)
 
-    def rotate_image(self, image: np.ndarray, angle: int = 90) -> np.ndarray:
-        if angle == 90:
-            return cv2.rotate(image, cv2.ROTATE_90_CLOCKWISE)
-        elif angle == 180:
-            return cv2.rotate(image, cv2.ROTATE_180)
-        elif angle == 270:
-            return cv2.rotate(image, cv2.ROTATE_90_COUNTERCLOCKWISE)
+
+class KeepAliveAdapter(HTTPAdapter):
+    """HTTPAdapter whose pooled sockets use TCP keep-alive probes."""
+
+    def __init__(self, idle=30, interval=10, count=3, **kwargs):
+        options = list(HTTPConnection.default_socket_options)
+        options.append((socket.SOL_SOCKET, socket.SO_KEEPALIVE, 1))
+        # Probe tuning is platform specific; skip what this OS doesn't have
+        for name, value in (("TCP_KEEPIDLE", idle), ("TCP_KEEPINTVL", interval), ("TCP_KEEPCNT", count)):
+            if hasattr(socket, name):
+                options.append((socket.IPPROTO_TCP, getattr(socket, name), value))
+        self.socket_options = options
+        super().__init__(**kwargs)
+
+    def init_poolmanager(self, *args, **kwargs):
+        kwargs["socket_options"] = self.socket_options
+        super().init_poolmanager(*args, **kwargs)
+
+
+class BatchUnsupported(RuntimeError):
+    """The detection API has no batch endpoint at the URL used."""
+
+
+class DetectionClient:
+    """
+    HTTP client for the detection API. Connections are kept alive in a
+    pool and reused across frames. post() is synchronous; submit() sends
+    on a thread pool with up to max_in_flight requests outstanding and
+    returns a Future of (response, time_taken). Responses that arrive
+    after a newer frame's response has already been delivered are stale
+    and resolve to None instead.
+    """
+
+    def __init__(self, url=API_URL, api_key=API_KEY, timeout=API_TIMEOUT,
+                 pool_size=API_POOL_SIZE, max_in_flight=API_MAX_IN_FLIGHT, tcp_keepalive=True):
+        self.url = url
+        self.timeout = timeout
+        self.session = requests.Session()
+        self.session.headers.update({"api_key": api_key, "Connection": "keep-alive"})
+        if tcp_keepalive:
+            adapter = KeepAliveAdapter(pool_connections=1, pool_maxsize=pool_size)
         else:
-            (h, w) = image.shape[:2]
-            center = (w // 2, h // 2)
-            M = cv2.getRotationMatrix2D(center, -angle, 1.0)
-            rotated = cv2.warpAffine(image, M, (w, h))
-            return rotated
+            adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_size)
+        self.session.mount("http://", adapter)
+        self.session.mount("https://", adapter)
 
-    def send_image(self, image: bytes):
-        headers = {"api_key": API_KEY}
-        files = {"file": ("frame.jpg", image, "image/jpeg")}
+        self.max_in_flight = max_in_flight
+        self._pool = ThreadPoolExecutor(max_workers=max_in_flight, thread_name_prefix="detect")
+        self._lock = threading.Lock()
+        self._in_flight = 0
+        self._next_seq = 0
+        self._delivered_seq = -1
+
+        self._upload = metrics.timer("upload", "Detection API round trip")
+        self._requests = metrics.counter("api_requests_total", "Requests sent to the detection API")
+        self._errors = metrics.counter("api_errors_total", "Detection API requests that failed")
+
+    def post(self, image: bytes, filename="frame.jpg", content_type="image/jpeg"):
+        return self._send(self.url, {"file": (filename, image, content_type)})
+
+    def post_batch(self, images, url=API_BATCH_URL):
+        """
+        Send several (image, filename, content_type) in one request to the
+        batch endpoint; returns ([response per image], time_taken), or
+        (None, None) if the request failed. Raises BatchUnsupported if the
+        endpoint answers 404 or 405.
+        """
+        files = [("files", (filename, image, content_type)) for image, filename, content_type in images]
+        result, time_taken = self._send(url, files, unsupported=(404, 405))
+        if result is None:
+            return None, None
+        results = result.get("results") if isinstance(result, dict) else None
+        if not isinstance(results, list) or len(results) != len(images):
+            self._errors.inc()
+            log.error("Unexpected batch response format for %d image(s).", len(images))
+            return None, None
+        return results, time_taken
+
+    def _send(self, url, files, unsupported=()):
+        # unsupported: HTTP statuses raised as BatchUnsupported instead of logged
+        response = None
+        self._requests.inc()
         try:
-            print("Sending frame to the API...")
+            log.debug("Sending frame to the API...")
             start_time = time.perf_counter()
-            response = requests.post(API_URL, headers=headers, files=files, timeout=60)
+            response = self.session.post(url, files=files, timeout=self.timeout)
             end_time = time.perf_counter()
             time_taken = end_time - start_time
+            self._upload.observe(time_taken)
             response.raise_for_status()
-            print(f"Frame sent successfully. Received response in {time_taken:.2f} seconds.")
+            log.debug("Frame sent successfully. Received response in %.2f seconds.", time_taken)
             return response.json(), time_taken
         except requests.exceptions.HTTPError as http_err:
-            print(f"HTTP error occurred: {http_err}")
-            if response and response.content:
-                print(f"Response content: {response.text}")
+            self._errors.inc()
+            if response is not None and response.status_code in unsupported:
+                raise BatchUnsupported(f"{url} answered {response.status_code}") from http_err
+            log.error("HTTP error occurred: %s", http_err)
+            if response is not None and response.content:
+                log.error("Response content: %s", response.text)
             return None, None
         except requests.exceptions.ConnectionError:
-            print("Error: Failed to connect to the API server. Please check your network connection and API endpoint.")
+            self._errors.inc()
+            log.error("Failed to connect to the API server. Please check your network connection and API endpoint.")
             return None, None
         except requests.exceptions.Timeout:
-            print("Error: The request timed out. The server may be busy or unresponsive.")
+            self._errors.inc()
+            log.error("The request timed out. The server may be busy or unresponsive.")
             return None, None
         except requests.exceptions.RequestException as err:
-            print(f"An unexpected error occurred: {err}")
+            self._errors.inc()
+            log.error("An unexpected error occurred: %s", err)
             return None, None
 
-    def process_response(self, response: dict, cropped_frame: np.ndarray):
-        if not response:
-            return []
-
-        print("\n--- Detection Results ---")
-        detected_phones = []
-
-        if "phones" in response:
-            phones = response["phones"]
-            if phones:
-                print(f"\nDetected {len(phones)} phone(s) in the frame:\n")
-                for idx, phone in enumerate(phones, start=1):
-                    coords = phone.get("coordinates", {})
-                    center = phone.get("center", {})
-                    confidence = phone.get("confidence", 0)
-                    required_keys = {'x1', 'y1', 'x2', 'y2'}
-                    if not required_keys.issubset(coords.keys()) or not {'x', 'y'}.issubset(center.keys()):
-                        print(f"Phone {idx}: Incomplete coordinate data. Skipping.")
-                        continue
-
-                    try:
-                        x1 = int(round(coords['x1']))
-                        y1 = int(round(coords['y1']))
-                        x2 = int(round(coords['x2']))
-                        y2 = int(round(coords['y2']))
-                        center_x = int(round(center['x']))
-                        center_y = int(round(center['y']))
-
-                        print(f"Phone {idx}:")
-                        print(f"  Bounding Box -> x1: {x1}, y1: {y1}, x2: {x2}, y2: {y2}")
-                        print(f"  Center -> x: {center_x}, y: {center_y}")
-                        print(f"  Confidence: {confidence:.2f}\n")
-
-                        cv2.rectangle(cropped_frame, (x1, y1), (x2, y2), (0, 255, 0), 2)
-                        cv2.circle(cropped_frame, (center_x, center_y), 5, (0, 0, 255), -1)
-                        label_confidence = f"Conf: {confidence:.2f}"
-                        cv2.putText(cropped_frame, label_confidence, (x1, y1 - 10), 
-                                    cv2.FONT_HERSHEY_SIMPLEX, 0.5, (0, 255, 0), 2)
-
-                        label_coords = f"Box: ({x1}, {y1}), ({x2}, {y2})"
-                        text_size, _ = cv2.getTextSize(label_coords, cv2.FONT_HERSHEY_SIMPLEX, 0.5, 1)
-                        text_width, text_height = text_size
-                        text_x = x1
-                        text_y = y1 - 25 if y1 - 25 > text_height else y1 + text_height + 25
-
-                        cv2.rectangle(cropped_frame, (text_x, text_y - text_height - 5), 
-                                      (text_x + text_width + 10, text_y + 5), (0, 255, 0), cv2.FILLED)
-                        cv2.putText(cropped_frame, label_coords, (text_x + 5, text_y), 
-                                    cv2.FONT_HERSHEY_SIMPLEX, 0.5, (0, 0, 0), 1)
-
-                        label_center = f"Center: ({center_x}, {center_y})"
-                        text_size_center, _ = cv2.getTextSize(label_center, cv2.FONT_HERSHEY_SIMPLEX, 0.5, 1)
-                        text_width_center, text_height_center = text_size_center
-                        text_x_center = center_x + 10 if center_x + 10 + text_width_center < cropped_frame.shape[1] else center_x - text_width_center - 10
-                        text_y_center = center_y + 10 if center_y + 10 + text_height_center < cropped_frame.shape[0] else center_y - 10
-
-                        cv2.rectangle(cropped_frame, (text_x_center, text_y_center - text_height_center - 5), 
-                                      (text_x_center + text_width_center + 10, text_y_center + 5), 
-                                      (0, 0, 255), cv2.FILLED)
-
-                        cv2.putText(cropped_frame, label_center, (text_x_center + 5, text_y_center), 
-                                    cv2.FONT_HERSHEY_SIMPLEX, 0.5, (255, 255, 255), 1)
-
-                        detected_phones.append((center_x, center_y, confidence))
-
-                    except (ValueError, TypeError) as e:
-                        print(f"Error processing phone {idx} coordinates: {e}")
-                        continue
-            else:
-                print("No phones detected in the frame.")
-        elif "message" in response:
-            print(f"Message from API: {response['message']}")
+    def submit(self, image: bytes):
+        """Send image in the background; returns None if max_in_flight are already pending."""
+        return self.submit_call(self.post, image)
+
+    def submit_call(self, fn, *args):
+        """Run fn(*args) on the request pool with the same in-flight and staleness rules."""
+        with self._lock:
+            if self._in_flight >= self.max_in_flight:
+                return None
+            self._in_flight += 1
+            seq = self._next_seq
+            self._next_seq += 1
+        return self._pool.submit(self._call_in_order, seq, fn, args)
+
+    def _call_in_order(self, seq, fn, args):
+        try:
+            result = fn(*args)
+        finally:
+            with self._lock:
+                self._in_flight -= 1
+        with self._lock:
+            if seq < self._delivered_seq:
+                return None
+            self._delivered_seq = seq
+        return result
+
+    @property
+    def in_flight(self):
+        return self._in_flight
+
+    def close(self):
+        self._pool.shutdown(wait=True)
+        self.session.close()
+
+
+class DetectionBackend:
+    """
+    Turns a rotated ROI image into a response dict in the detection API's
+    format ({"phones": [{"coordinates", "center", "confidence"}]}), so
+    parse_response handles every backend the same way.
+    infer() returns None when the backend could not produce an answer.
+    """
+
+    name = None
+
+    def infer(self, image: np.ndarray):
+        raise NotImplementedError
+
+    def close(self):
+        pass
+
+
+def scale_response(response: dict, factor: float) -> dict:
+    """Multiply every coordinate in an API response by factor, in place."""
+    for phone in response.get("phones") or ():
+        for group in (phone.get("coordinates"), phone.get("center")):
+            if not isinstance(group, dict):
+                continue
+            for key, value in group.items():
+                if isinstance(value, (int, float)):
+                    group[key] = value * factor
+    return response
+
+
+class Detections:
+    """
+    Phones parsed from one response: boxes (N, 4) as x1, y1, x2, y2 and
+    centers (N, 2), both int32 table pixels, and confidences (N,).
+    Iterating yields (center_x, center_y, confidence) per phone, the shape
+    the tracker and the rest of the pipeline consume.
+    """
+
+    __slots__ = ("boxes", "centers", "confidences")
+
+    def __init__(self, boxes, centers, confidences):
+        self.boxes = boxes
+        self.centers = centers
+        self.confidences = confidences
+
+    def __len__(self):
+        return len(self.confidences)
+
+    def __iter__(self):
+        return zip(*self.centers.T.tolist(), self.confidences.tolist())
+
+    def __repr__(self):
+        return f"Detections({list(self)})"
+
+
+NO_DETECTIONS = Detections(np.empty((0, 4), np.int32), np.empty((0, 2), np.int32),
+                           np.empty(0, np.float64))
+
+
+def _phone_values(phone):
+    # x1, y1, x2, y2, center x, center y, confidence; NaN marks a missing value
+    coords = phone.get("coordinates")
+    center = phone.get("center")
+    if not isinstance(coords, dict) or not isinstance(center, dict):
+        return (np.nan,) * 7
+    return (coords.get("x1", np.nan), coords.get("y1", np.nan),
+            coords.get("x2", np.nan), coords.get("y2", np.nan),
+            center.get("x", np.nan), center.get("y", np.nan),
+            phone.get("confidence", 0))
+
+
+def _as_float(value):
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return np.nan
+
+
+def parse_response(response) -> Detections:
+    """
+    Turn a detection response into Detections. Every phone is validated in
+    one pass over a numpy array: phones with missing or non-numeric
+    coordinates are dropped and counted in a single warning.
+    """
+    if not response:
+        return NO_DETECTIONS
+    if "phones" not in response:
+        if "message" in response:
+            log.info("Message from API: %s", response['message'])
         else:
-            print("Unexpected response format:")
-            print(json.dumps(response, indent=4))
+            log.warning("Unexpected response format:\n%s", json.dumps(response, indent=4))
+        return NO_DETECTIONS
+    phones = response["phones"]
+    if not phones:
+        log.debug("No phones detected in the frame.")
+        return NO_DETECTIONS
+
+    rows = [_phone_values(phone) if isinstance(phone, dict) else (np.nan,) * 7
+            for phone in phones]
+    try:
+        values = np.array(rows, dtype=np.float64)
+    except (TypeError, ValueError):
+        # Something non-numeric in there: convert value by value
+        values = np.array([[_as_float(v) for v in row] for row in rows], dtype=np.float64)
 
-        return detected_phones
+    valid = np.isfinite(values).all(axis=1)
+    if not valid.all():
+        log.warning("Skipped %d phone(s) with incomplete coordinate data.", int((~valid).sum()))
+        values = values[valid]
+    detections = Detections(np.rint(values[:, :4]).astype(np.int32),
+                            np.rint(values[:, 4:6]).astype(np.int32),
+                            values[:, 6].copy())
+    log.debug("Detected %d phone(s) in the frame: %s", len(detections), detections)
+    return detections
 
-    def detect(self, frame: np.ndarray):
-        cropped_frame = frame[ROI_Y1:ROI_Y2, ROI_X1:ROI_X2]
-        rotated_frame = self.rotate_image(cropped_frame, angle=90)
 
-        # Encode rotated frame
-        ret, buffer = cv2.imencode('.jpg', rotated_frame)
-        if not ret:
-            print("Failed to encode frame.")
+def annotate(image: np.ndarray, detections: Detections) -> np.ndarray:
+    """Draw boxes, centres and labels for detections onto image, in place."""
+    font = cv2.FONT_HERSHEY_SIMPLEX
+    height, width = image.shape[:2]
+    for (x1, y1, x2, y2), (center_x, center_y), confidence in zip(
+            detections.boxes.tolist(), detections.centers.tolist(),
+            detections.confidences.tolist()):
+        cv2.rectangle(image, (x1, y1), (x2, y2), (0, 255, 0), 2)
+        cv2.circle(image, (center_x, center_y), 5, (0, 0, 255), -1)
+        cv2.putText(image, f"Conf: {confidence:.2f}", (x1, y1 - 10), font, 0.5, (0, 255, 0), 2)
+
+        label_coords = f"Box: ({x1}, {y1}), ({x2}, {y2})"
+        (text_width, text_height), _ = cv2.getTextSize(label_coords, font, 0.5, 1)
+        text_x = x1
+        text_y = y1 - 25 if y1 - 25 > text_height else y1 + text_height + 25
+        cv2.rectangle(image, (text_x, text_y - text_height - 5),
+                      (text_x + text_width + 10, text_y + 5), (0, 255, 0), cv2.FILLED)
+        cv2.putText(image, label_coords, (text_x + 5, text_y), font, 0.5, (0, 0, 0), 1)
+
+        label_center = f"Center: ({center_x}, {center_y})"
+        (text_width, text_height), _ = cv2.getTextSize(label_center, font, 0.5, 1)
+        text_x = center_x + 10 if center_x + 10 + text_width < width else center_x - text_width - 10
+        text_y = center_y + 10 if center_y + 10 + text_height < height else center_y - 10
+        cv2.rectangle(image, (text_x, text_y - text_height - 5),
+                      (text_x + text_width + 10, text_y + 5), (0, 0, 255), cv2.FILLED)
+        cv2.putText(image, label_center, (text_x + 5, text_y), font, 0.5, (255, 255, 255), 1)
+    return image
+
+
+class RemoteBackend(DetectionBackend):
+    """
+    The cloud YOLO service at API_URL. Frames go through a FrameEncoder,
+    and coordinates in the answer are mapped back to full-ROI pixels.
+    client is a DetectionClient, or anything with the same post(), such
+    as a DetectionDispatcher shared by several tables.
+    """
+
+    name = "remote"
+
+    def __init__(self, client, encoder=None):
+        self.client = client
+        self.encoder = encoder if encoder is not None else FrameEncoder()
+
+    def infer(self, image: np.ndarray):
+        image_bytes, scale = self.encoder.encode(image)
+        if image_bytes is None:
+            return None
+        response, time_taken = self.client.post(image_bytes, *self.encoder.file_info)
+        if response is None:
+            return None
+        self.encoder.feedback(time_taken)
+        if scale != 1.0:
+            scale_response(response, 1.0 / scale)
+        return response
+
+
+class LocalBackend(DetectionBackend):
+    """
+    An exported YOLO (v5 or v8 style) ONNX model run on the CPU through
+    OpenCV DNN or onnxruntime. The model is loaded once; the letterbox
+    canvas and the input blob are preallocated and reused every frame, and
+    the letterbox geometry is cached per input size.
+    """
+
+    name = "local"
+    PAD_VALUE = 114
+
+    def __init__(self, model_path=LOCAL_MODEL_PATH, engine=LOCAL_MODEL_ENGINE,
+                 input_size=LOCAL_MODEL_INPUT_SIZE, class_ids=LOCAL_MODEL_CLASS_IDS,
+                 conf_threshold=LOCAL_CONF_THRESHOLD, nms_threshold=LOCAL_NMS_THRESHOLD):
+        self.engine = engine
+        if engine == "onnxruntime":
+            import onnxruntime
+            self.session = onnxruntime.InferenceSession(model_path, providers=["CPUExecutionProvider"])
+            self.input_name = self.session.get_inputs()[0].name
+        elif engine == "opencv":
+            self.net = cv2.dnn.readNetFromONNX(model_path)
+            self.net.setPreferableBackend(cv2.dnn.DNN_BACKEND_OPENCV)
+            self.net.setPreferableTarget(cv2.dnn.DNN_TARGET_CPU)
+        else:
+            raise ValueError(f"Unknown local inference engine: {engine}")
+
+        self.input_size = input_size
+        self.class_ids = np.asarray(class_ids)
+        self.conf_threshold = conf_threshold
+        self.nms_threshold = nms_threshold
+        self.canvas = np.full((input_size, input_size, 3), self.PAD_VALUE, np.uint8)
+        self.blob = np.empty((1, 3, input_size, input_size), np.float32)
+        self._letterbox_cache = {}
+        self._geometry = None
+        # The net and the shared canvas/blob serve one frame at a time
+        self._lock = threading.Lock()
+
+    def letterbox(self, image: np.ndarray):
+        h, w = image.shape[:2]
+        geometry = self._letterbox_cache.get((h, w))
+        if geometry is None:
+            scale = min(self.input_size / h, self.input_size / w)
+            new_w, new_h = int(round(w * scale)), int(round(h * scale))
+            pad_x = (self.input_size - new_w) // 2
+            pad_y = (self.input_size - new_h) // 2
+            resized = np.empty((new_h, new_w, 3), np.uint8)
+            geometry = (scale, pad_x, pad_y, resized)
+            self._letterbox_cache[(h, w)] = geometry
+        if geometry is not self._geometry:
+            # Padding only needs repainting when the input geometry changes
+            self.canvas[:] = self.PAD_VALUE
+            self._geometry = geometry
+        scale, pad_x, pad_y, resized = geometry
+        cv2.resize(image, (resized.shape[1], resized.shape[0]), dst=resized,
+                   interpolation=cv2.INTER_LINEAR)
+        self.canvas[pad_y:pad_y + resized.shape[0], pad_x:pad_x + resized.shape[1]] = resized
+        # HWC BGR uint8 -> NCHW RGB float32 in [0, 1], written into the reused blob
+        np.multiply(self.canvas.transpose(2, 0, 1)[::-1], np.float32(1 / 255), out=self.blob[0])
+        return scale, pad_x, pad_y
+
+    def forward(self):
+        if self.engine == "onnxruntime":
+            return self.session.run(None, {self.input_name: self.blob})[0]
+        self.net.setInput(self.blob)
+        return self.net.forward()
+
+    def infer(self, image: np.ndarray):
+        with self._lock:
+            scale, pad_x, pad_y = self.letterbox(image)
+            preds = self.forward()[0].copy()
+        if preds.shape[0] < preds.shape[1]:
+            # v8 layout: (4 + classes, N), no objectness column
+            preds = preds.T
+            scores = preds[:, 4 + self.class_ids].max(axis=1)
+        else:
+            # v5 layout: (N, 5 + classes)
+            scores = preds[:, 4] * preds[:, 5 + self.class_ids].max(axis=1)
+
+        keep = scores > self.conf_threshold
+        boxes = preds[keep, :4]
+        scores = scores[keep]
+        # centre/size in letterbox pixels -> corner boxes in image pixels
+        x1 = (boxes[:, 0] - boxes[:, 2] / 2 - pad_x) / scale
+        y1 = (boxes[:, 1] - boxes[:, 3] / 2 - pad_y) / scale
+        w = boxes[:, 2] / scale
+        h = boxes[:, 3] / scale
+        rects = np.stack([x1, y1, w, h], axis=1)
+        indices = cv2.dnn.NMSBoxes(rects.tolist(), scores.tolist(),
+                                   self.conf_threshold, self.nms_threshold)
+
+        phones = []
+        for i in np.asarray(indices).reshape(-1):
+            bx, by, bw, bh = rects[i]
+            phones.append({
+                "coordinates": {"x1": float(bx), "y1": float(by),
+                                "x2": float(bx + bw), "y2": float(by + bh)},
+                "center": {"x": float(bx + bw / 2), "y": float(by + bh / 2)},
+                "confidence": float(scores[i]),
+            })
+        return {"phones": phones}
+
+
+def make_backends(names=DETECTION_BACKENDS, client=None, remote=None):
+    """
+    Build backends in the given order, e.g. ("local", "remote") for local-first.
+    remote, if given, is used as the remote backend instead of a RemoteBackend.
+    """
+    backends = []
+    for name in names:
+        if name == "remote":
+            if remote is None:
+                remote = RemoteBackend(client if client is not None else DetectionClient())
+            backends.append(remote)
+        elif name == "local":
+            if not os.path.exists(LOCAL_MODEL_PATH):
+                log.warning("Local model %s not found; local detection disabled.", LOCAL_MODEL_PATH)
+                continue
+            try:
+                backends.append(LocalBackend())
+            except (ImportError, cv2.error) as err:
+                log.warning("Could not load local model: %s", err)
+        else:
+            raise ValueError(f"Unknown detection backend: {name}")
+    if not backends:
+        raise RuntimeError("No detection backend available.")
+    return backends
+
+
+class Detector:
+    def __init__(self, client=None, gate=None, backends=None, preprocessor=None,
+                 annotate_frames=False, cache=None):
+        # Shared with red-light detection so both see one table image per frame
+        self.preprocessor = preprocessor if preprocessor is not None else RoiPreprocessor()
+        # With backends supplied, the client (for submit() and send_image())
+        # is only created on first use, so unused ones hold no pool
+        self._client = client
+        if backends is None:
+            backends = make_backends(client=self.client)
+        # Tried in order until one answers; see make_backends
+        self.backends = backends
+        # Optional change_gate.ChangeGate: unchanged frames reuse the last result
+        self.gate = gate
+        # Optional detection_cache.DetectionCache: near-duplicate table
+        # images reuse an earlier answer instead of going to a backend
+        self.cache = cache
+        self.last_phones = NO_DETECTIONS
+        # Draw detections onto the returned frames; off for headless runs,
+        # which can still call annotate() on the frames they do display
+        self.annotate_frames = annotate_frames
+
+        self._detect = metrics.timer("detect", "Detector.detect, inference and parsing included")
+        self._parse = metrics.timer("parse", "Parsing a detection response")
+        self._gate_skips = metrics.counter("gate_skips_total", "Frames the change gate held back")
+
+    @property
+    def client(self):
+        if self._client is None:
+            self._client = DetectionClient()
+        return self._client
+
+    def rotate_image(self, image: np.ndarray, angle: int = 90) -> np.ndarray:
+        if angle == 90:
+            return cv2.rotate(image, cv2.ROTATE_90_CLOCKWISE)
+        elif angle == 180:
+            return cv2.rotate(image, cv2.ROTATE_180)
+        elif angle == 270:
+            return cv2.rotate(image, cv2.ROTATE_90_COUNTERCLOCKWISE)
+        else:
+            (h, w) = image.shape[:2]
+            center = (w // 2, h // 2)
+            M = cv2.getRotationMatrix2D(center, -angle, 1.0)
+            rotated = cv2.warpAffine(image, M, (w, h))
+            return rotated
+
+    def send_image(self, image: bytes):
+        return self.client.post(image)
+
+    def process_response(self, response: dict, cropped_frame: np.ndarray):
+        """Parse a response and draw it onto cropped_frame; returns [(cx, cy, conf)]."""
+        detections = self.parse(response)
+        annotate(cropped_frame, detections)
+        return list(detections)
+
+    def parse(self, response):
+        with self._parse.time():
+            return parse_response(response)
+
+    def prepare(self, frame: np.ndarray, key=None):
+        return self.preprocessor.process(frame, key)
+
+    def annotate(self, table_frame: np.ndarray, detections):
+        # Draw on a copy so the shared table image stays clean for red-light
+        # detection; only frames with phones get overlays, so only they pay
+        if not len(detections):
+            return table_frame
+        return annotate(table_frame.copy(), detections)
+
+    def overlay_target(self, detections, table_frame: np.ndarray):
+        if not self.annotate_frames:
+            return table_frame
+        return self.annotate(table_frame, detections)
+
+    def infer(self, image: np.ndarray):
+        """Response dict from the first backend that answers, or None."""
+        for backend in self.backends:
+            response = backend.infer(image)
+            if response is not None:
+                return response
+        return None
+
+    def check_gate(self, image: np.ndarray):
+        if self.gate is None:
+            return True, None
+        return self.gate.check(image)
+
+    def cached(self, image: np.ndarray, force=False):
+        """
+        (cache_key, cached detected_phones or None); (None, None) without a
+        cache. With force the key is still computed, so the fresh answer
+        gets stored, but no cached answer is returned.
+        """
+        if self.cache is None:
             return None, None
+        cache_key = self.cache.key(image)
+        if force:
+            return cache_key, None
+        return cache_key, self.cache.lookup(cache_key)
+
+    def remember(self, response, detected_phones, thumb, cache_key=None):
+        # Only a real answer (from a backend or the cache) may become the
+        # gate's reference
+        if response is None:
+            return
+        self.last_phones = detected_phones
+        if thumb is not None:
+            self.gate.accept(thumb)
+        if cache_key is not None:
+            self.cache.store(cache_key, detected_phones)
 
-        image_bytes = buffer.tobytes()
-        response, _ = self.send_image(image_bytes)
-        detected_phones = self.process_response(response, rotated_frame)
+    def detect(self, frame: np.ndarray = None, key=None, force=False, image=None):
+        # force: query the backends even if the gate sees no change or the
+        # cache has an answer, e.g. to confirm a phone independently
+        # image: the frame's table-space image, if already prepared; the
+        # camera frame is then not needed
+        rotated_frame = image if image is not None else self.prepare(frame, key)
+        send, thumb = self.check_gate(rotated_frame)
+        if not send and not force:
+            self._gate_skips.inc()
+            return None, self.last_phones
+
+        with self._detect.time():
+            cache_key, detected_phones = self.cached(rotated_frame, force)
+            if detected_phones is not None:
+                self.remember(True, detected_phones, thumb)
+                return self.overlay_target(detected_phones, rotated_frame), detected_phones
+            response = self.infer(rotated_frame)
+            detected_phones = self.parse(response)
+            rotated_frame = self.overlay_target(detected_phones, rotated_frame)
+        self.remember(response, detected_phones, thumb, cache_key)
 
         return rotated_frame, detected_phones
+
+    def submit(self, frame: np.ndarray = None, key=None, force=False, image=None):
+        """
+        Pipelined detect(): returns a Future of (rotated_frame, detected_phones),
+        or None if the client already has max_in_flight frames pending.
+        Stale responses resolve to (rotated_frame, None); frames the gate
+        holds back resolve at once to (None, last detected_phones), and
+        cache hits at once to (rotated_frame, cached detected_phones).
+        As for detect(), image is the frame's table-space image if already
+        prepared.
+        """
+        if self.client.in_flight >= self.client.max_in_flight:
+            return None
+        start = time.perf_counter()
+        rotated_frame = image if image is not None else self.prepare(frame, key)
+        send, thumb = self.check_gate(rotated_frame)
+        if not send and not force:
+            self._gate_skips.inc()
+            result = Future()
+            result.set_result((None, self.last_phones))
+            return result
+        cache_key, detected_phones = self.cached(rotated_frame, force)
+        if detected_phones is not None:
+            self.remember(True, detected_phones, thumb)
+            result = Future()
+            frame_out = self.overlay_target(detected_phones, rotated_frame)
+            self._detect.observe(time.perf_counter() - start)
+            result.set_result((frame_out, detected_phones))
+            return result
+        # Wrapped in a tuple so a failed inference (None) isn't mistaken for stale
+        sent = self.client.submit_call(lambda: (self.infer(rotated_frame),))
+        if sent is None:
+            return None
+
+        result = Future()
+
+        def finish(sent):
+            try:
+                outcome = sent.result()
+                frame_out = rotated_frame
+                if outcome is None:
+                    detected_phones = None
+                else:
+                    detected_phones = self.parse(outcome[0])
+                    frame_out = self.overlay_target(detected_phones, rotated_frame)
+                    self.remember(outcome[0], detected_phones, thumb, cache_key)
+                self._detect.observe(time.perf_counter() - start)
+                result.set_result((frame_out, detected_phones))
+            except Exception as exc:
+                result.set_exception(exc)
+
+        sent.add_done_callback(finish)
+        return result
@@ -0,0 +1,139 @@
+# detection_cache.py
+import threading
+import time
+from collections import OrderedDict
+
+import cv2
+import numpy as np
+
+from config import (DETECTION_CACHE_SIZE, DETECTION_CACHE_TTL, DETECTION_CACHE_TOLERANCE,
+                    DETECTION_CACHE_HASH, DETECTION_CACHE_GRID)
+from metrics import metrics
+
+
+def dhash(image: np.ndarray, size=8) -> int:
+    """Difference hash: size*size bits, set where a pixel is brighter than its right neighbour."""
+    small = cv2.resize(image, (size + 1, size), interpolation=cv2.INTER_AREA)
+    if small.ndim == 3:
+        small = cv2.cvtColor(small, cv2.COLOR_BGR2GRAY)
+    bits = small[:, 1:] > small[:, :-1]
+    return int.from_bytes(np.packbits(bits).tobytes(), "big")
+
+
+def phash(image: np.ndarray, size=8, scale=4) -> int:
+    """DCT hash: size*size bits, set where a low-frequency coefficient is above their median."""
+    side = size * scale
+    small = cv2.resize(image, (side, side), interpolation=cv2.INTER_AREA)
+    if small.ndim == 3:
+        small = cv2.cvtColor(small, cv2.COLOR_BGR2GRAY)
+    low = cv2.dct(np.float32(small))[:size, :size]
+    bits = low > np.median(low)
+    return int.from_bytes(np.packbits(bits).tobytes(), "big")
+
+
+HASHES = {"dhash": dhash, "phash": phash}
+# Grayscale (width, height) each hash downsamples a cell to
+HASH_INPUT = {"dhash": (9, 8), "phash": (32, 32)}
+
+
+class DetectionCache:
+    """
+    Reuses detection results for near-duplicate table images.
+
+    Images are keyed by a perceptual hash of every cell of a rows x cols
+    grid, so a phone-sized change shows up as many flipped bits in the
+    cells it covers instead of a few in one hash of the whole table. A
+    lookup hits when no cell of a cached key differs in more than
+    `tolerance` bits and the entry is younger than `ttl` seconds.
+    At most max_entries results are kept, least recently used evicted
+    first. invalidate() drops everything; wire it to the motion executor,
+    since the head and pads move through the picture.
+    """
+
+    def __init__(self, max_entries=DETECTION_CACHE_SIZE, ttl=DETECTION_CACHE_TTL,
+                 tolerance=DETECTION_CACHE_TOLERANCE, hash=DETECTION_CACHE_HASH,
+                 grid=DETECTION_CACHE_GRID):
+        if hash not in HASHES:
+            raise ValueError(f"Unknown image hash: {hash}")
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.tolerance = tolerance
+        self.hash = HASHES[hash]
+        self.cell_size = HASH_INPUT[hash]
+        self.grid = grid
+        self._entries = OrderedDict()  # key -> (phones, stored_at)
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.invalidations = 0
+
+        self._hit_count = metrics.counter("detection_cache_hits_total", "Detections served from cache")
+        self._miss_count = metrics.counter("detection_cache_misses_total",
+                                           "Detections the cache could not serve")
+
+    def key(self, image: np.ndarray) -> tuple:
+        """One hash per grid cell, row by row."""
+        rows, cols = self.grid
+        cell_w, cell_h = self.cell_size
+        # Downsample the whole image once; each cell is then already at hash size
+        if image.ndim == 3:
+            image = cv2.cvtColor(image, cv2.COLOR_BGR2GRAY)
+        small = cv2.resize(image, (cols * cell_w, rows * cell_h), interpolation=cv2.INTER_AREA)
+        return tuple(self.hash(small[r * cell_h:(r + 1) * cell_h, c * cell_w:(c + 1) * cell_w])
+                     for r in range(rows) for c in range(cols))
+
+    def _distance(self, cached, key):
+        # Total differing bits, or None if any cell differs by more than tolerance
+        total = 0
+        for a, b in zip(cached, key):
+            bits = bin(a ^ b).count("1")
+            if bits > self.tolerance:
+                return None
+            total += bits
+        return total
+
+    def lookup(self, key):
+        """Cached phones for the closest near-duplicate of key, or None."""
+        now = time.monotonic()
+        with self._lock:
+            best, best_distance = None, None
+            for cached, (_, stored_at) in list(self._entries.items()):
+                if self.ttl and now - stored_at > self.ttl:
+                    del self._entries[cached]
+                    continue
+                distance = self._distance(cached, key)
+                if distance is not None and (best is None or distance < best_distance):
+                    best, best_distance = cached, distance
+            if best is None:
+                self.misses += 1
+                self._miss_count.inc()
+                return None
+            self._entries.move_to_end(best)
+            self.hits += 1
+            self._hit_count.inc()
+            return self._entries[best][0]
+
+    def store(self, key, phones):
+        with self._lock:
+            self._entries[key] = (phones, time.monotonic())
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def invalidate(self):
+        with self._lock:
+            if self._entries:
+                self._entries.clear()
+                self.invalidations += 1
+
+    def __len__(self):
+        return len(self._entries)
+
+    @property
+    def hit_rate(self):
+        total = self.hits + self.misses
+        return self.hits / total if total else 0.0
+
+    def stats(self):
+        return {"hits": self.hits, "misses": self.misses, "hit_rate": self.hit_rate,
+                "entries": len(self._entries), "invalidations": self.invalidations}
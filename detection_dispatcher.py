@@ -0,0 +1,129 @@
+# detection_dispatcher.py
+import logging
+import threading
+import time
+from collections import deque
+from concurrent.futures import Future, ThreadPoolExecutor
+
+from config import DISPATCH_MAX_BATCH, DISPATCH_MAX_DELAY, DISPATCH_MAX_IN_FLIGHT, API_BATCH_URL
+from detection import BatchUnsupported, DetectionClient
+from metrics import metrics
+
+log = logging.getLogger(__name__)
+
+BATCH_BUCKETS = (1, 2, 3, 4, 6, 8, 12, 16, 32)
+
+
+class DetectionDispatcher:
+    """
+    One detection client shared by several tables. Frames queued with
+    submit() from any thread are sent together as multi-image requests:
+    a batch goes out once max_batch frames are waiting or the oldest has
+    waited max_delay seconds, with up to max_in_flight batches outstanding.
+    While every slot is busy frames keep queueing, so batches grow with
+    load instead of requests piling up. Batches of one use the ordinary
+    single-image endpoint, and so does every frame once batch_url is None,
+    either as configured or because the API turned out not to have it.
+    """
+
+    def __init__(self, client=None, max_batch=DISPATCH_MAX_BATCH, max_delay=DISPATCH_MAX_DELAY,
+                 max_in_flight=DISPATCH_MAX_IN_FLIGHT, batch_url=API_BATCH_URL):
+        self.client = client if client is not None else DetectionClient(max_in_flight=max_in_flight)
+        self.max_batch = max_batch
+        self.max_delay = max_delay
+        self.batch_url = batch_url
+        self._pending = deque()  # (future, image, filename, content_type, queued_at)
+        self._cond = threading.Condition()
+        self._slots = threading.BoundedSemaphore(max_in_flight)
+        self._pool = ThreadPoolExecutor(max_workers=max_in_flight, thread_name_prefix="dispatch")
+        self._stopped = False
+
+        self._batch_size = metrics.histogram("detection_batch_size", "Frames per detection request",
+                                             buckets=BATCH_BUCKETS)
+        self._wait = metrics.timer("batch_wait", "Time a frame waited for its batch to be sent")
+
+        self._thread = threading.Thread(target=self._run, name="detection-dispatcher", daemon=True)
+        self._thread.start()
+
+    def submit(self, image: bytes, filename="frame.jpg", content_type="image/jpeg"):
+        """Queue an encoded frame; returns a Future of (response, time_taken)."""
+        future = Future()
+        with self._cond:
+            if self._stopped:
+                raise RuntimeError("Detection dispatcher is closed.")
+            self._pending.append((future, image, filename, content_type, time.perf_counter()))
+            self._cond.notify_all()
+        return future
+
+    def post(self, image: bytes, filename="frame.jpg", content_type="image/jpeg"):
+        """Blocking submit(), shaped like DetectionClient.post."""
+        return self.submit(image, filename, content_type).result()
+
+    def _take(self):
+        # Wait for a frame, then for the batch to fill or its deadline to pass
+        with self._cond:
+            while not self._pending and not self._stopped:
+                self._cond.wait()
+            if not self._pending:
+                return None
+            # Without a batch endpoint every frame is a request of its own
+            max_batch = self.max_batch if self.batch_url is not None else 1
+            deadline = self._pending[0][4] + self.max_delay
+            while len(self._pending) < max_batch and not self._stopped:
+                remaining = deadline - time.perf_counter()
+                if remaining <= 0:
+                    break
+                self._cond.wait(remaining)
+            count = min(len(self._pending), max_batch)
+            return [self._pending.popleft() for _ in range(count)]
+
+    def _run(self):
+        while True:
+            self._slots.acquire()
+            batch = self._take()
+            if batch is None:
+                self._slots.release()
+                return
+            now = time.perf_counter()
+            for item in batch:
+                self._wait.observe(now - item[4])
+            self._batch_size.observe(len(batch))
+            self._pool.submit(self._send, batch)
+
+    def _send(self, batch):
+        try:
+            results = None
+            batch_url = self.batch_url
+            if len(batch) > 1 and batch_url is not None:
+                try:
+                    responses, time_taken = self.client.post_batch(
+                        [(image, filename, content_type) for _, image, filename, content_type, _ in batch],
+                        url=batch_url)
+                except BatchUnsupported as exc:
+                    log.warning("No batch endpoint (%s); sending frames one per request.", exc)
+                    self.batch_url = None
+                else:
+                    if responses is None:
+                        responses = [None] * len(batch)
+                    results = [(response, time_taken if response is not None else None)
+                               for response in responses]
+            if results is None:
+                results = [self.client.post(image, filename, content_type)
+                           for _, image, filename, content_type, _ in batch]
+            for (future, _, _, _, _), result in zip(batch, results):
+                future.set_result(result)
+        except Exception as exc:
+            for future, _, _, _, _ in batch:
+                if not future.done():
+                    future.set_exception(exc)
+        finally:
+            self._slots.release()
+
+    def close(self):
+        with self._cond:
+            self._stopped = True
+            self._cond.notify_all()
+        self._thread.join()
+        self._pool.shutdown(wait=True)
+        self.client.close()
+
@@ -0,0 +1,96 @@
+# encoding.py
+import logging
+import threading
+
+import cv2
+import numpy as np
+
+from metrics import metrics
+from config import (ENCODE_FORMAT, ENCODE_MAX_SIDE, ENCODE_GRAYSCALE, ENCODE_QUALITY,
+                    ENCODE_MIN_QUALITY, ENCODE_MAX_QUALITY, ENCODE_TARGET_LATENCY)
+
+log = logging.getLogger(__name__)
+
+
+class FrameEncoder:
+    """
+    Encode stage for frames uploaded to the detection API.
+
+    Frames are downscaled so their longer side is at most max_side (the
+    model input size; upscaling never happens), optionally converted to
+    grayscale, and compressed as JPEG or WebP. encode() returns the bytes
+    and the scale applied, so callers can map returned coordinates back to
+    the original image. feedback() nudges the quality towards
+    target_latency using the measured round-trip time.
+    """
+
+    FORMATS = {
+        "jpg": (".jpg", cv2.IMWRITE_JPEG_QUALITY, "frame.jpg", "image/jpeg"),
+        "webp": (".webp", cv2.IMWRITE_WEBP_QUALITY, "frame.webp", "image/webp"),
+    }
+    QUALITY_STEP = 5
+
+    def __init__(self, fmt=ENCODE_FORMAT, max_side=ENCODE_MAX_SIDE, grayscale=ENCODE_GRAYSCALE,
+                 quality=ENCODE_QUALITY, min_quality=ENCODE_MIN_QUALITY,
+                 max_quality=ENCODE_MAX_QUALITY, target_latency=ENCODE_TARGET_LATENCY):
+        if fmt not in self.FORMATS:
+            raise ValueError(f"Unsupported encode format: {fmt}")
+        self.ext, self._quality_flag, filename, content_type = self.FORMATS[fmt]
+        self.file_info = (filename, content_type)
+        self.max_side = max_side
+        self.grayscale = grayscale
+        self.quality = quality
+        self.min_quality = min_quality
+        self.max_quality = max_quality
+        self.target_latency = target_latency
+        self._buffers = {}
+        self._lock = threading.Lock()
+
+        self.frames = 0
+        self.total_bytes = 0
+        self.last_bytes = 0
+        self._encode = metrics.timer("encode", "Resizing and compressing a frame for upload")
+        self._bytes = metrics.counter("encoded_bytes_total", "Bytes produced for upload")
+
+    def _buffer(self, key, shape):
+        buffer = self._buffers.get(key)
+        if buffer is None or buffer.shape != shape:
+            buffer = self._buffers[key] = np.empty(shape, np.uint8)
+        return buffer
+
+    def encode(self, image: np.ndarray):
+        """Returns (bytes, scale), or (None, None) if encoding failed."""
+        with self._lock, self._encode.time():
+            h, w = image.shape[:2]
+            scale = min(1.0, self.max_side / max(h, w)) if self.max_side else 1.0
+            if scale < 1.0:
+                size = (int(round(w * scale)), int(round(h * scale)))
+                resized = self._buffer("resized", (size[1], size[0]) + image.shape[2:])
+                image = cv2.resize(image, size, dst=resized, interpolation=cv2.INTER_AREA)
+            if self.grayscale and image.ndim == 3:
+                gray = self._buffer("gray", image.shape[:2])
+                image = cv2.cvtColor(image, cv2.COLOR_BGR2GRAY, dst=gray)
+
+            ret, buffer = cv2.imencode(self.ext, image, (self._quality_flag, int(self.quality)))
+            if not ret:
+                log.error("Failed to encode frame.")
+                return None, None
+
+            self.frames += 1
+            self.last_bytes = buffer.nbytes
+            self.total_bytes += buffer.nbytes
+            self._bytes.inc(buffer.nbytes)
+            return buffer.tobytes(), scale
+
+    def feedback(self, latency):
+        if latency is None or not self.target_latency:
+            return
+        with self._lock:
+            if latency > self.target_latency * 1.2:
+                self.quality = max(self.min_quality, self.quality - self.QUALITY_STEP)
+            elif latency < self.target_latency * 0.8:
+                self.quality = min(self.max_quality, self.quality + 1)
+
+    @property
+    def bytes_per_frame(self):
+        return self.total_bytes / self.frames if self.frames else 0.0
@@ -1,6 +1,8 @@
 # gantry.py
-import RPi.GPIO as GPIO
-import time
+import numpy as np
+from metrics import metrics
+from motion import MotionProfile, build_train, interleave, merge_trains
+from step_backends import HIGH, LOW, make_step_backend
 
 class Gantry:
     MOTOR_A_DIR_PIN = 20
@@ -14,55 +16,74 @@ class Gantry:
     STEPS_PER_UNIT_Y = 39.9
     
     STEPS_Z = 27500
-    STEP_DELAY = 60e-6
+    STEP_DELAY = 60e-6  # cruise step period
 
-    def __init__(self, initial_x=0.0, initial_y=0.0):
+    # Z depths in steps below the top of the stroke. Z only travels between
+    # the pick and retract depths, so these can be trimmed to the pads.
+    Z_PICK_DEPTH = STEPS_Z
+    Z_RETRACT_DEPTH = 0
+    # Above this depth the head clears the table: XY may move while Z is
+    # higher, and a descending Z may reach it before XY has stopped
+    Z_CLEAR_DEPTH = STEPS_Z // 2
+    Z_LEAD_TIME = 0.1  # max seconds a descending Z overlaps XY braking
+
+    # Acceleration profile (steps/s, steps/s^2); see motion.MotionProfile
+    START_STEP_RATE = 2000
+    MAX_STEP_RATE = 1 / STEP_DELAY
+    ACCELERATION = 40000
+    PROFILE_SHAPE = "trapezoid"
+
+    def __init__(self, initial_x=0.0, initial_y=0.0, backend=None, initial_z=None, journal=None,
+                 pins=None):
+        # backend: a step_backends.StepBackend; defaults to config.STEP_BACKEND
+        self.backend = backend if backend is not None else make_step_backend()
+        # pins: overrides of the *_PIN attributes, for a second gantry on one board
+        for name, pin in (pins or {}).items():
+            if not name.endswith("_PIN") or not hasattr(self, name):
+                raise ValueError(f"Unknown gantry pin: {name}")
+            setattr(self, name, pin)
+        # journal: a journal.Journal told about every move, for crash recovery
+        self.journal = journal
         self.current_x = initial_x
         self.current_y = initial_y
-        self.current_z = 0
+        self.z_position = self.Z_RETRACT_DEPTH if initial_z is None else initial_z
+        self.current_z = 1 if self.z_position > self.Z_RETRACT_DEPTH else 0
+        self.profile = MotionProfile(self.START_STEP_RATE, self.MAX_STEP_RATE,
+                                     self.ACCELERATION, self.PROFILE_SHAPE)
+        self._xy_ticks = metrics.counter("gantry_xy_ticks_total", "XY step ticks issued")
+        self._z_steps = metrics.counter("gantry_z_steps_total", "Z steps issued")
         self.initGantry()
 
     def initGantry(self):
-        GPIO.setmode(GPIO.BCM)
-        GPIO.setup(self.MOTOR_A_DIR_PIN, GPIO.OUT)
-        GPIO.setup(self.MOTOR_A_STEP_PIN, GPIO.OUT)
-        GPIO.setup(self.MOTOR_B_DIR_PIN, GPIO.OUT)
-        GPIO.setup(self.MOTOR_B_STEP_PIN, GPIO.OUT)
-        GPIO.setup(self.MOTOR_C_DIR_PIN, GPIO.OUT)
-        GPIO.setup(self.MOTOR_C_STEP_PIN, GPIO.OUT)
+        self.backend.setup((
+            self.MOTOR_A_DIR_PIN, self.MOTOR_A_STEP_PIN,
+            self.MOTOR_B_DIR_PIN, self.MOTOR_B_STEP_PIN,
+            self.MOTOR_C_DIR_PIN, self.MOTOR_C_STEP_PIN,
+        ))
 
     def setDirection(self, direction):
         # direction: 1=forward, 2=backward, 3=left, 4=right
         if direction == 1:  # forward (+Y)
-            GPIO.output(self.MOTOR_A_DIR_PIN, GPIO.LOW)
-            GPIO.output(self.MOTOR_B_DIR_PIN, GPIO.LOW)
+            self.backend.write(self.MOTOR_A_DIR_PIN, LOW)
+            self.backend.write(self.MOTOR_B_DIR_PIN, LOW)
         elif direction == 2: # backward (-Y)
-            GPIO.output(self.MOTOR_A_DIR_PIN, GPIO.HIGH)
-            GPIO.output(self.MOTOR_B_DIR_PIN, GPIO.HIGH)
+            self.backend.write(self.MOTOR_A_DIR_PIN, HIGH)
+            self.backend.write(self.MOTOR_B_DIR_PIN, HIGH)
         elif direction == 3: # left (-X)
-            GPIO.output(self.MOTOR_A_DIR_PIN, GPIO.LOW)
-            GPIO.output(self.MOTOR_B_DIR_PIN, GPIO.HIGH)
+            self.backend.write(self.MOTOR_A_DIR_PIN, LOW)
+            self.backend.write(self.MOTOR_B_DIR_PIN, HIGH)
         elif direction == 4: # right (+X)
-            GPIO.output(self.MOTOR_A_DIR_PIN, GPIO.HIGH)
-            GPIO.output(self.MOTOR_B_DIR_PIN, GPIO.LOW)
+            self.backend.write(self.MOTOR_A_DIR_PIN, HIGH)
+            self.backend.write(self.MOTOR_B_DIR_PIN, LOW)
         else:
             raise ValueError("Invalid direction specified.")
     
     def moveVertical(self):
-        # Toggle Z direction
-        if self.current_z == 0:
-            GPIO.output(self.MOTOR_C_DIR_PIN, GPIO.LOW)
-            self.current_z = 1
-        else:
-            GPIO.output(self.MOTOR_C_DIR_PIN, GPIO.HIGH)
-            self.current_z = 0
+        # Toggle between the pick and retract depths
+        self.runSequence([("z", None)])
 
-        count = 0
-        while count <= self.STEPS_Z:
-            GPIO.output(self.MOTOR_C_STEP_PIN, GPIO.LOW)                                                                                                                                                            
-            GPIO.output(self.MOTOR_C_STEP_PIN, GPIO.HIGH)
-            count += 1
-            time.sleep(self.STEP_DELAY)
+    def moveZ(self, depth):
+        self.runSequence([("z", depth)])
 
     def move2D(self, direction, dist):
         self.setDirection(direction)
@@ -71,12 +92,10 @@ class Gantry:
         else:  # left/right (X-axis)
             total_steps = int(self.STEPS_PER_UNIT * dist)
 
-        for _ in range(total_steps):
-            GPIO.output(self.MOTOR_A_STEP_PIN, GPIO.LOW)
-            GPIO.output(self.MOTOR_A_STEP_PIN, GPIO.HIGH)
-            GPIO.output(self.MOTOR_B_STEP_PIN, GPIO.LOW)
-            GPIO.output(self.MOTOR_B_STEP_PIN, GPIO.HIGH)
-            time.sleep(self.STEP_DELAY)
+        deadlines = self.profile.deadlines(total_steps)
+        if self.journal is not None:
+            self.journal.move()
+        self.backend.run(build_train(deadlines, (self.MOTOR_A_STEP_PIN, self.MOTOR_B_STEP_PIN)))
 
         if direction == 1:  # forward (+Y)
             self.current_y -= dist
@@ -86,8 +105,142 @@ class Gantry:
             self.current_x += dist
         elif direction == 4:  # right (+X)
             self.current_x -= dist
+        if self.journal is not None:
+            self.journal.position(self.current_x, self.current_y, self.z_position)
+
+    def motorSteps(self, dx, dy):
+        # CoreXY: motor A turns with (X - Y), motor B with (-X - Y), in the
+        # same sign convention setDirection uses for the single-axis moves.
+        steps_x = int(self.STEPS_PER_UNIT * dx)
+        steps_y = int(self.STEPS_PER_UNIT_Y * dy)
+        return steps_x - steps_y, -steps_x - steps_y
+
+    def travelTime(self, start, end):
+        # Seconds for a coordinated move between two (x, y) points
+        steps_a, steps_b = self.motorSteps(end[0] - start[0], end[1] - start[1])
+        return self.profile.duration(max(abs(steps_a), abs(steps_b)))
+
+    def travelTimes(self, starts, ends):
+        # Vectorised travelTime: seconds from every start to every end
+        starts = np.asarray(starts, dtype=np.float64).reshape(-1, 2)
+        ends = np.asarray(ends, dtype=np.float64).reshape(-1, 2)
+        delta = ends[None, :, :] - starts[:, None, :]
+        steps_x = (self.STEPS_PER_UNIT * delta[..., 0]).astype(np.int64)
+        steps_y = (self.STEPS_PER_UNIT_Y * delta[..., 1]).astype(np.int64)
+        steps = np.maximum(np.abs(steps_x - steps_y), np.abs(steps_x + steps_y))
+        return self.profile.durations(steps)
+
+    def xyTrain(self, start, end, offset=0):
+        # Pulse train for a coordinated move; returns (train, ticks)
+        steps_a, steps_b = self.motorSteps(end[0] - start[0], end[1] - start[1])
+        dirs = ((self.MOTOR_A_DIR_PIN, LOW if steps_a >= 0 else HIGH),
+                (self.MOTOR_B_DIR_PIN, LOW if steps_b >= 0 else HIGH))
+
+        # The motor with more steps pulses every tick, the other one is
+        # spread evenly across the same ticks, all under one ramp.
+        pin_sets = {
+            (True, True): (self.MOTOR_A_STEP_PIN, self.MOTOR_B_STEP_PIN),
+            (True, False): (self.MOTOR_A_STEP_PIN,),
+            (False, True): (self.MOTOR_B_STEP_PIN,),
+            (False, False): (),
+        }
+        ticks = [pin_sets[tick] for tick in interleave(abs(steps_a), abs(steps_b))]
+        if not ticks:
+            return [], 0
+        return build_train(self.profile.deadlines(len(ticks)), ticks, dirs, offset), len(ticks)
+
+    def runSequence(self, moves, done=None):
+        """
+        Run ("xy", (x, y)) and ("z", depth) moves in order, overlapping the
+        axes where that is safe: a descending Z starts up to Z_LEAD_TIME
+        before XY stops (without passing Z_CLEAR_DEPTH while XY still runs),
+        and XY starts as soon as a rising Z is above Z_CLEAR_DEPTH. A depth
+        of None toggles between Z_PICK_DEPTH and Z_RETRACT_DEPTH.
+
+        Overlapping moves are merged into one pulse train; done(i) is called
+        after each train has run, i being the last move it completed.
+        """
+        x, y, z = self.current_x, self.current_y, self.z_position
+        trains = []
+        end = 0          # ns at which the moves merged so far finish
+        xy_ready = None  # earliest start for XY behind a rising Z
+        z_ready = None   # earliest start for Z behind XY
+        for i, (axis, target) in enumerate(moves):
+            if axis == "xy":
+                start = end if xy_ready is None else xy_ready
+            else:
+                depth = target
+                if depth is None:
+                    depth = self.Z_RETRACT_DEPTH if z > self.Z_RETRACT_DEPTH else self.Z_PICK_DEPTH
+                steps = abs(depth - z)
+                deadlines = self.profile.deadlines(steps)
+                length = self._nanoseconds(steps)
+                start = end
+                if depth > z and z_ready is not None:
+                    clear = self._reach(deadlines, self.Z_CLEAR_DEPTH - z, length)
+                    start = max(z_ready, end - clear)
+
+            if trains and start >= end:
+                # Nothing left to overlap with: run what we have first
+                self._runTrains(trains, x, y, z)
+                if done is not None:
+                    done(i - 1)
+                trains, start, end = [], 0, 0
+
+            if axis == "xy":
+                train, steps = self.xyTrain((x, y), target, start)
+                self._xy_ticks.inc(steps)
+                length = self._nanoseconds(steps)
+                lead = min(self.Z_LEAD_TIME, self.profile.decel_time(steps))
+                z_ready = start + length - round(lead * 1e9)
+                xy_ready = None
+                x, y = target
+            else:
+                train = []
+                self._z_steps.inc(steps)
+                if steps:
+                    dirs = ((self.MOTOR_C_DIR_PIN, LOW if depth > z else HIGH),)
+                    train = build_train(deadlines, (self.MOTOR_C_STEP_PIN,), dirs, start)
+                xy_ready = None
+                if depth < z:
+                    xy_ready = start + self._reach(deadlines, z - self.Z_CLEAR_DEPTH, length)
+                z_ready = None
+                z = depth
+            if train:
+                trains.append(train)
+            end = max(end, start + length)
+
+        self._runTrains(trains, x, y, z)
+        if done is not None and moves:
+            done(len(moves) - 1)
+
+    def _runTrains(self, trains, x, y, z):
+        if trains:
+            if self.journal is not None:
+                self.journal.move()
+            self.backend.run(merge_trains(*trains))
+        self.current_x, self.current_y = x, y
+        self.z_position = z
+        self.current_z = 1 if z > self.Z_RETRACT_DEPTH else 0
+        if trains and self.journal is not None:
+            self.journal.position(x, y, z)
+
+    def _nanoseconds(self, steps):
+        return round(self.profile.duration(steps) * 1e9)
+
+    @staticmethod
+    def _reach(deadlines, steps, length):
+        # Time (ns) into a move by which `steps` pulses have been sent
+        if steps <= 0:
+            return 0
+        return int(deadlines[steps]) if steps < len(deadlines) else length
+
+    def goTo(self, x, y, coordinated=True):
+        if coordinated:
+            if x != self.current_x or y != self.current_y:
+                self.runSequence([("xy", (x, y))])
+            return
 
-    def goTo(self, x, y):
         dx = x - self.current_x
         if dx > 0:  
             self.move2D(3, abs(dx))
@@ -101,4 +254,4 @@ class Gantry:
             self.move2D(1, abs(dy))
 
     def cleanup(self):
-        GPIO.cleanup()
+        self.backend.cleanup()
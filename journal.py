@@ -0,0 +1,177 @@
+# journal.py
+import json
+import logging
+import os
+import threading
+import time
+
+from config import JOURNAL_SYNC_INTERVAL, JOURNAL_COMPACT_EVERY
+
+log = logging.getLogger(__name__)
+
+
+def empty_state():
+    # pads: {track_id: {"pad": pad_index, "position": [px, py], "stage": ...}},
+    # stage being "reserved", "placed" or "retrieving"
+    return {"gantry": {"x": 0.0, "y": 0.0, "z": 0, "moving": False}, "pads": {}}
+
+
+def apply(state, record):
+    """Fold one journal record into state."""
+    op = record["op"]
+    if op == "snapshot":
+        state.clear()
+        state.update(record["state"])
+        state["pads"] = {int(track_id): pad for track_id, pad in state["pads"].items()}
+    elif op == "move":
+        state["gantry"]["moving"] = True
+    elif op == "position":
+        state["gantry"] = {"x": record["x"], "y": record["y"], "z": record["z"], "moving": False}
+    elif op == "reserve":
+        state["pads"][record["track"]] = {"pad": record["pad"], "position": record["position"],
+                                          "stage": "reserved"}
+    elif op in ("placed", "retrieving"):
+        if record["track"] in state["pads"]:
+            state["pads"][record["track"]]["stage"] = op
+    elif op == "returned":
+        state["pads"].pop(record["track"], None)
+    else:
+        raise ValueError(f"Unknown journal record: {op}")
+
+
+class Journal:
+    """
+    Append-only record of the gantry position and the pads' whereabouts,
+    so a restarted controller can pick up where it stopped instead of
+    re-homing the gantry and searching the table for pads.
+
+    Records are JSON lines. Every append is flushed to the OS at once; a
+    background thread fsyncs at most every sync_interval seconds, so a
+    power cut can lose that much of the tail but a crash of the process
+    loses nothing. After compact_every records the file is atomically
+    rewritten as a single snapshot of the current state.
+
+    Gantry moves are journalled as a "move" record before the pulses go
+    out and a "position" record once they have run, so replay can tell
+    when the head stopped somewhere between the two.
+    """
+
+    def __init__(self, path, sync_interval=JOURNAL_SYNC_INTERVAL,
+                 compact_every=JOURNAL_COMPACT_EVERY):
+        self.path = path
+        self.sync_interval = sync_interval
+        self.compact_every = compact_every
+        self.state = empty_state()
+        self._lock = threading.Lock()
+        self._records = 0
+        self._dirty = False
+        self._file = None
+        self._closed = threading.Event()
+        self._syncer = None
+
+    def replay(self):
+        """Load the journal (if any) and open it for appending; returns the state."""
+        start = time.perf_counter()
+        state = empty_state()
+        records = 0
+        if os.path.exists(self.path):
+            with open(self.path, "rb") as f:
+                for number, line in enumerate(f, 1):
+                    try:
+                        record = json.loads(line)
+                    except ValueError:
+                        # A torn last line from a crash mid-write
+                        log.warning("Ignoring unreadable journal record %d.", number)
+                        continue
+                    apply(state, record)
+                    records += 1
+        self.state = state
+        self._records = records
+        self.compact()
+        self._syncer = threading.Thread(target=self._sync_loop, name="journal-sync", daemon=True)
+        self._syncer.start()
+        log.info("Replayed %d journal record(s) in %.1f ms.", records,
+                 (time.perf_counter() - start) * 1e3)
+        return state
+
+    def append(self, op, **fields):
+        record = dict(fields, op=op)
+        with self._lock:
+            apply(self.state, record)
+            if self._file is None:
+                return
+            self._file.write(json.dumps(record, separators=(",", ":")) + "\n")
+            self._file.flush()
+            self._dirty = True
+            self._records += 1
+            if self._records >= self.compact_every:
+                self._compact()
+
+    # Gantry
+    def move(self):
+        self.append("move")
+
+    def position(self, x, y, z):
+        self.append("position", x=float(x), y=float(y), z=int(z))
+
+    # Pads
+    def reserve(self, track_id, pad_index, position):
+        self.append("reserve", track=track_id, pad=pad_index, position=[float(p) for p in position])
+
+    def placed(self, track_id):
+        self.append("placed", track=track_id)
+
+    def retrieving(self, track_id):
+        self.append("retrieving", track=track_id)
+
+    def returned(self, track_id):
+        self.append("returned", track=track_id)
+
+    def compact(self):
+        with self._lock:
+            self._compact()
+
+    def _compact(self):
+        # Write the snapshot next to the journal, then swap it in
+        tmp = self.path + ".tmp"
+        with open(tmp, "w") as f:
+            f.write(json.dumps({"op": "snapshot", "state": self.state}, separators=(",", ":")) + "\n")
+            f.flush()
+            os.fsync(f.fileno())
+        if self._file is not None:
+            self._file.close()
+        os.replace(tmp, self.path)
+        self._fsync_dir()
+        self._file = open(self.path, "a")
+        self._records = 1
+        self._dirty = False
+
+    def _fsync_dir(self):
+        try:
+            fd = os.open(os.path.dirname(os.path.abspath(self.path)), os.O_RDONLY)
+        except OSError:
+            return  # not supported here (Windows)
+        try:
+            os.fsync(fd)
+        finally:
+            os.close(fd)
+
+    def sync(self):
+        with self._lock:
+            if self._file is not None and self._dirty:
+                os.fsync(self._file.fileno())
+                self._dirty = False
+
+    def _sync_loop(self):
+        while not self._closed.wait(self.sync_interval):
+            self.sync()
+
+    def close(self):
+        self._closed.set()
+        if self._syncer is not None:
+            self._syncer.join()
+        self.sync()
+        with self._lock:
+            if self._file is not None:
+                self._file.close()
+                self._file = None
@@ -0,0 +1,221 @@
+# metrics.py
+import bisect
+import json
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from config import (METRICS_ENABLED, METRICS_PORT, METRICS_JSONL_PATH,
+                    METRICS_JSONL_INTERVAL)
+
+# Seconds; spans a local ROI scan up to a slow API round trip
+DEFAULT_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1,
+                   0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+
+class Counter:
+    kind = "counter"
+
+    def __init__(self, name, doc=""):
+        self.name = name
+        self.doc = doc
+        self.value = 0
+        self._lock = threading.Lock()
+
+    def inc(self, amount=1):
+        with self._lock:
+            self.value += amount
+
+    def snapshot(self):
+        return self.value
+
+
+class Histogram:
+    kind = "histogram"
+
+    def __init__(self, name, doc="", buckets=DEFAULT_BUCKETS):
+        self.name = name
+        self.doc = doc
+        self.buckets = tuple(sorted(buckets))
+        self.counts = [0] * (len(self.buckets) + 1)  # last slot is +Inf
+        self.count = 0
+        self.sum = 0.0
+        self._lock = threading.Lock()
+
+    def observe(self, value):
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            self.counts[index] += 1
+            self.count += 1
+            self.sum += value
+
+    def time(self):
+        return _Timer(self)
+
+    def snapshot(self):
+        with self._lock:
+            return {"count": self.count, "sum": self.sum,
+                    "buckets": dict(zip(self.buckets + (float("inf"),), self.counts))}
+
+
+class _Timer:
+    __slots__ = ("histogram", "start")
+
+    def __init__(self, histogram):
+        self.histogram = histogram
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self.histogram.observe(time.perf_counter() - self.start)
+        return False
+
+
+class _NullMetric:
+    """Stands in for every metric while metrics are disabled; all no-ops."""
+
+    def inc(self, amount=1):
+        pass
+
+    def observe(self, value):
+        pass
+
+    def time(self):
+        return self
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+
+NULL_METRIC = _NullMetric()
+
+
+class Registry:
+    """
+    Process-wide counters and histograms with Prometheus text and JSON-lines
+    export. Callers look their metrics up once (at construction) and keep
+    them; while the registry is disabled every lookup returns NULL_METRIC,
+    so instrumented hot paths cost one no-op method call.
+
+        self._encode = metrics.timer("encode")
+        with self._encode.time():
+            ...
+    """
+
+    def __init__(self, enabled=METRICS_ENABLED):
+        self.enabled = enabled
+        self._metrics = {}
+        self._lock = threading.Lock()
+        self._server = None
+        self._writer = None
+        self._stopped = threading.Event()
+
+    def _get(self, cls, name, doc, **kwargs):
+        if not self.enabled:
+            return NULL_METRIC
+        with self._lock:
+            metric = self._metrics.get(name)
+            if metric is None:
+                metric = self._metrics[name] = cls(name, doc, **kwargs)
+            elif not isinstance(metric, cls):
+                raise ValueError(f"Metric {name} is already registered as a {metric.kind}.")
+            return metric
+
+    def counter(self, name, doc=""):
+        return self._get(Counter, name, doc)
+
+    def histogram(self, name, doc="", buckets=DEFAULT_BUCKETS):
+        return self._get(Histogram, name, doc, buckets=buckets)
+
+    def timer(self, stage, doc=""):
+        """Histogram of a stage's duration in seconds; time it with `with timer.time():`."""
+        return self.histogram(f"{stage}_seconds", doc or f"Time spent in {stage}")
+
+    def snapshot(self):
+        with self._lock:
+            metrics = list(self._metrics.values())
+        return {metric.name: metric.snapshot() for metric in metrics}
+
+    def render_prometheus(self):
+        with self._lock:
+            metrics = list(self._metrics.values())
+        lines = []
+        for metric in metrics:
+            if metric.doc:
+                lines.append(f"# HELP {metric.name} {metric.doc}")
+            lines.append(f"# TYPE {metric.name} {metric.kind}")
+            if metric.kind == "counter":
+                lines.append(f"{metric.name} {metric.value}")
+                continue
+            snap = metric.snapshot()
+            cumulative = 0
+            for bound, count in snap["buckets"].items():
+                cumulative += count
+                le = "+Inf" if bound == float("inf") else repr(bound)
+                lines.append(f'{metric.name}_bucket{{le="{le}"}} {cumulative}')
+            lines.append(f"{metric.name}_sum {snap['sum']}")
+            lines.append(f"{metric.name}_count {snap['count']}")
+        return "\n".join(lines) + "\n"
+
+    def serve(self, port=METRICS_PORT, host="127.0.0.1"):
+        """Serve /metrics in the Prometheus text format on a background thread."""
+        registry = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                if self.path.rstrip("/") not in ("", "/metrics"):
+                    self.send_error(404)
+                    return
+                body = registry.render_prometheus().encode()
+                self.send_response(200)
+                self.send_header("Content-Type", "text/plain; version=0.0.4")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, *args):
+                pass
+
+        self._server = ThreadingHTTPServer((host, port), Handler)
+        threading.Thread(target=self._server.serve_forever, name="metrics-http",
+                         daemon=True).start()
+        return self._server
+
+    def write_jsonl(self, path=METRICS_JSONL_PATH, interval=METRICS_JSONL_INTERVAL):
+        """Append a {"time": ..., metric: value} line to path every interval seconds."""
+
+        def run():
+            with open(path, "a") as out:
+                while not self._stopped.wait(interval):
+                    out.write(json.dumps({"time": time.time(), **self.snapshot()},
+                                         default=str) + "\n")
+                    out.flush()
+
+        self._writer = threading.Thread(target=run, name="metrics-jsonl", daemon=True)
+        self._writer.start()
+        return self._writer
+
+    def start_exporters(self):
+        """Start whichever exporters config asks for, if metrics are enabled."""
+        if not self.enabled:
+            return
+        if METRICS_PORT:
+            self.serve(METRICS_PORT)
+        if METRICS_JSONL_PATH:
+            self.write_jsonl(METRICS_JSONL_PATH)
+
+    def close(self):
+        self._stopped.set()
+        if self._server is not None:
+            self._server.shutdown()
+            self._server.server_close()
+        if self._writer is not None:
+            self._writer.join()
+
+
+metrics = Registry()
@@ -0,0 +1,200 @@
+# motion.py
+import heapq
+import itertools
+import math
+import time
+
+import numpy as np
+
+# Below this much remaining time the pacer spins instead of sleeping;
+# time.sleep on the Pi routinely overshoots by a few hundred microseconds.
+SPIN_THRESHOLD_NS = 2_000_000
+# A pulse finishing later than this after its deadline (more than emitting
+# it normally takes) pushes the rest of the train back
+LATE_TOLERANCE_NS = 10_000
+
+
+class MotionProfile:
+    """
+    Step-interval tables for accelerated moves.
+
+    A profile ramps from start_rate to max_rate (steps/s) with the given
+    acceleration (steps/s^2), cruises, and ramps back down. shape is either
+    "trapezoid" (constant acceleration) or "s-curve" (acceleration eased in
+    and out, same average acceleration). Only the ramp is kept; each move's
+    deadlines are built from it on demand, since nearly every move has a
+    different step count.
+    """
+
+    SHAPES = ("trapezoid", "s-curve")
+
+    def __init__(self, start_rate, max_rate, acceleration, shape="trapezoid"):
+        if shape not in self.SHAPES:
+            raise ValueError(f"Unknown motion profile shape: {shape}")
+        if not 0 < start_rate <= max_rate or acceleration <= 0:
+            raise ValueError("Invalid motion profile rates.")
+        self.start_rate = float(start_rate)
+        self.max_rate = float(max_rate)
+        self.acceleration = float(acceleration)
+        self.shape = shape
+        self.ramp = self._build_ramp()
+        # ramp_elapsed[n] = time (ns) spent in the first n ramp steps
+        self.ramp_elapsed = (0,) + tuple(itertools.accumulate(self.ramp))
+        self._ramp = np.asarray(self.ramp, dtype=np.int64)
+
+    def _velocity(self, t):
+        v0, v1, a = self.start_rate, self.max_rate, self.acceleration
+        if self.shape == "trapezoid":
+            return min(v0 + a * t, v1)
+        ramp_time = (v1 - v0) / a
+        if t >= ramp_time:
+            return v1
+        return v0 + (v1 - v0) * (1 - math.cos(math.pi * t / ramp_time)) / 2
+
+    def _build_ramp(self):
+        # Walk the velocity curve one step at a time; each entry is the
+        # interval (ns) before the next step while still accelerating.
+        ramp = []
+        t = 0.0
+        v = self.start_rate
+        while v < self.max_rate:
+            dt = 1.0 / v
+            ramp.append(int(dt * 1e9))
+            t += dt
+            v = self._velocity(t)
+        return tuple(ramp)
+
+    def intervals(self, steps):
+        """Interval (ns) after each of `steps` pulses."""
+        if steps <= 0:
+            return ()
+        ramp = self.ramp
+        cruise = int(1e9 / self.max_rate)
+        if steps >= 2 * len(ramp):
+            return ramp + (cruise,) * (steps - 2 * len(ramp)) + ramp[::-1]
+        # Too short to reach cruise speed: accelerate halfway, then brake.
+        up = ramp[:steps - steps // 2]
+        down = ramp[:steps // 2][::-1]
+        return up + down
+
+    def deadlines(self, steps):
+        """
+        Offsets (ns) from the start of the move at which each of `steps`
+        pulses is due, as an int64 array.
+        """
+        if steps <= 0:
+            return np.zeros(0, dtype=np.int64)
+        ramp = self._ramp
+        if steps >= 2 * len(ramp):
+            cruise = np.full(steps - 2 * len(ramp), int(1e9 / self.max_rate), dtype=np.int64)
+            intervals = np.concatenate((ramp, cruise, ramp[::-1]))
+        else:
+            intervals = np.concatenate((ramp[:steps - steps // 2], ramp[:steps // 2][::-1]))
+        deadlines = np.empty(steps, dtype=np.int64)
+        deadlines[0] = 0
+        np.cumsum(intervals[:-1], out=deadlines[1:])
+        return deadlines
+
+    def duration(self, steps):
+        """Move time (s) for `steps` pulses, without building the table."""
+        if steps <= 0:
+            return 0.0
+        ramp = len(self.ramp)
+        if steps >= 2 * ramp:
+            cruise = int(1e9 / self.max_rate)
+            return (2 * self.ramp_elapsed[-1] + (steps - 2 * ramp) * cruise) / 1e9
+        return (self.ramp_elapsed[steps - steps // 2] + self.ramp_elapsed[steps // 2]) / 1e9
+
+    def decel_time(self, steps):
+        """Time (s) spent braking at the end of a `steps` move."""
+        return self.ramp_elapsed[min(len(self.ramp), max(steps, 0) // 2)] / 1e9
+
+    def durations(self, steps):
+        """Vectorised duration() over an integer array of step counts."""
+        steps = np.maximum(np.asarray(steps, dtype=np.int64), 0)
+        elapsed = np.asarray(self.ramp_elapsed, dtype=np.float64)
+        ramp = len(self.ramp)
+        cruise = int(1e9 / self.max_rate)
+        short = np.minimum(steps, max(2 * ramp - 1, 0))
+        t_short = elapsed[short - short // 2] + elapsed[short // 2]
+        t_full = 2 * elapsed[-1] + (steps - 2 * ramp) * cruise
+        return np.where(steps >= 2 * ramp, t_full, t_short) / 1e9
+
+
+def build_train(deadlines, pins, dirs=(), offset=0):
+    """
+    Pair each deadline with the step pins to pulse on that tick. pins is
+    either one tuple used for every tick or a sequence with one per tick.
+    dirs is a tuple of (pin, level) direction writes applied just before
+    the first pulse; offset shifts the whole train in time (ns).
+    """
+    if isinstance(deadlines, np.ndarray):
+        deadlines = deadlines.tolist()
+    if isinstance(pins, tuple):
+        train = [(offset + deadline, pins, ()) for deadline in deadlines]
+    else:
+        train = [(offset + deadline, tick, ()) for deadline, tick in zip(deadlines, pins) if tick]
+    if dirs:
+        if train:
+            deadline, first, _ = train[0]
+            train[0] = (deadline, first, dirs)
+        else:
+            train.append((offset, (), dirs))
+    return train
+
+
+def merge_trains(*trains):
+    """Merge time-sorted trains into one, combining entries due at the same time."""
+    merged = []
+    for deadline, pins, dirs in heapq.merge(*trains, key=lambda entry: entry[0]):
+        if merged and merged[-1][0] == deadline:
+            _, prev_pins, prev_dirs = merged[-1]
+            merged[-1] = (deadline, prev_pins + pins, prev_dirs + dirs)
+        else:
+            merged.append((deadline, pins, dirs))
+    return merged
+
+
+def run_paced(train, emit):
+    """
+    Call emit(pins, dirs) for each (deadline_ns, pins, dirs) in train, on
+    time. A pulse that goes out late (another thread held the GIL) shifts
+    the rest of the train by its lateness: the move takes longer, but no
+    two pulses are ever closer than the profile spaced them, which a
+    stepper would not follow.
+    """
+    clock = time.perf_counter_ns
+    start = clock()
+    for deadline, pins, dirs in train:
+        target = start + deadline
+        remaining = target - clock()
+        if remaining > SPIN_THRESHOLD_NS:
+            time.sleep((remaining - SPIN_THRESHOLD_NS) / 1e9)
+        while clock() < target:
+            pass
+        emit(pins, dirs)
+        # Measured after emit: the GIL may have been lost just before it
+        late = clock() - target
+        if late > LATE_TOLERANCE_NS:
+            start += late
+
+
+def interleave(steps_a, steps_b):
+    """
+    Bresenham/DDA interleaving of two step counts. Returns one (step_a,
+    step_b) pair per tick; the motor with more steps pulses on every tick.
+    """
+    major = max(steps_a, steps_b)
+    acc_a = acc_b = major // 2
+    ticks = []
+    for _ in range(major):
+        acc_a += steps_a
+        step_a = acc_a >= major
+        if step_a:
+            acc_a -= major
+        acc_b += steps_b
+        step_b = acc_b >= major
+        if step_b:
+            acc_b -= major
+        ticks.append((step_a, step_b))
+    return ticks
@@ -0,0 +1,199 @@
+# motion_executor.py
+import threading
+import time
+from collections import deque
+from concurrent.futures import Future
+
+from config import MOTION_SETTLE_XY, MOTION_SETTLE_Z
+from metrics import metrics
+
+
+class MotionExecutor:
+    """
+    Runs gantry commands on a worker thread so the caller can keep reading
+    and analysing frames. Commands execute in submission order; each call
+    returns a concurrent.futures.Future whose result is the time (s) the
+    command took, settle included. If a command fails, everything still
+    queued behind it is cancelled rather than run from an unknown position.
+
+    Listeners added with add_listener() are called on the worker thread
+    when a motion command starts and again once it has settled, e.g. to
+    drop cached views of the table that the move changes.
+
+    Consecutive goTo/moveVertical commands that are already queued when the
+    worker picks them up run as one Gantry.runSequence, so Z can overlap
+    the XY moves around it. Settle times then apply only where the
+    sequence actually stops, after the last move of each merged train.
+    """
+
+    def __init__(self, gantry, settle_xy=MOTION_SETTLE_XY, settle_z=MOTION_SETTLE_Z):
+        self.gantry = gantry
+        self.settle_xy = settle_xy
+        self.settle_z = settle_z
+        self._pending = deque()
+        self._unfinished = 0
+        self._cond = threading.Condition()
+        self._listeners = []
+        # One observation per train actually run: moves merged into a train
+        # share its time, so per-command timings would count it repeatedly
+        self._train_time = metrics.timer("motion_train", "Gantry motion trains, settle included")
+        self._worker = threading.Thread(target=self._run, name="motion-executor", daemon=True)
+        self._worker.start()
+
+    def _put(self, items):
+        with self._cond:
+            self._pending.extend(items)
+            self._unfinished += len(items)
+            self._cond.notify_all()
+
+    def _task_done(self, count=1):
+        with self._cond:
+            self._unfinished -= count
+            if not self._unfinished:
+                self._cond.notify_all()
+
+    @staticmethod
+    def _future(callback):
+        future = Future()
+        if callback is not None:
+            future.add_done_callback(callback)
+        return future
+
+    def submit(self, fn, *args, settle=0.0, callback=None):
+        future = self._future(callback)
+        self._put([(future, fn, args, settle, None)])
+        return future
+
+    def _motion(self, move, callback):
+        # Queue items are (future, fn, args, settle, move); move is None
+        # for commands that can't be merged into a motion sequence
+        if move[0] == "xy":
+            return (self._future(callback), self.gantry.goTo, move[1], self.settle_xy, move)
+        if move[1] is None:
+            return (self._future(callback), self.gantry.moveVertical, (), self.settle_z, move)
+        return (self._future(callback), self.gantry.moveZ, (move[1],), self.settle_z, move)
+
+    def goTo(self, x, y, callback=None):
+        item = self._motion(("xy", (x, y)), callback)
+        self._put([item])
+        return item[0]
+
+    def moveVertical(self, callback=None):
+        item = self._motion(("z", None), callback)
+        self._put([item])
+        return item[0]
+
+    def sequence(self, moves, callback=None):
+        """
+        Queue ("xy", (x, y)) / ("z", depth) moves in one go, so they are
+        guaranteed to be merged; a depth of None toggles Z. Returns one
+        future per move.
+        """
+        items = [self._motion(move, callback) for move in moves]
+        self._put(items)
+        return [item[0] for item in items]
+
+    def add_listener(self, fn):
+        self._listeners.append(fn)
+
+    def _notify(self):
+        for fn in self._listeners:
+            fn()
+
+    def dwell(self, seconds, callback=None):
+        return self.submit(time.sleep, seconds, callback=callback)
+
+    @property
+    def busy(self):
+        # _unfinished only drops once a command (and its settle) is done
+        return self._unfinished > 0
+
+    def wait_idle(self):
+        with self._cond:
+            while self._unfinished:
+                self._cond.wait()
+
+    def cancel_pending(self):
+        with self._cond:
+            items = [item for item in self._pending if item is not None]
+            self._pending = deque(item for item in self._pending if item is None)
+        for item in items:
+            item[0].cancel()
+        if items:
+            self._task_done(len(items))
+
+    def shutdown(self, wait=True):
+        if not wait:
+            self.cancel_pending()
+        self._put([None])
+        self._worker.join()
+
+    def _take(self):
+        # Next command, plus any motion commands queued right behind it
+        with self._cond:
+            while not self._pending:
+                self._cond.wait()
+            batch = [self._pending.popleft()]
+            if batch[0] is not None and batch[0][4] is not None:
+                while self._pending and self._pending[0] is not None and self._pending[0][4] is not None:
+                    batch.append(self._pending.popleft())
+            return batch
+
+    def _run(self):
+        while True:
+            batch = self._take()
+            if batch[0] is None:
+                self._task_done()
+                return
+            running = [item for item in batch if item[0].set_running_or_notify_cancel()]
+            if len(running) < len(batch):
+                self._task_done(len(batch) - len(running))
+            if not running:
+                continue
+            if running[0][4] is None:
+                self._call(running[0])
+            else:
+                self._sequence(running)
+
+    def _call(self, item):
+        future, fn, args, settle, _ = item
+        start = time.perf_counter()
+        try:
+            fn(*args)
+            if settle:
+                time.sleep(settle)
+        except BaseException as exc:
+            self.cancel_pending()
+            future.set_exception(exc)
+        else:
+            future.set_result(time.perf_counter() - start)
+        finally:
+            self._task_done()
+
+    def _sequence(self, items):
+        finished = 0
+        start = time.perf_counter()
+
+        def done(last):
+            nonlocal finished, start
+            settle = items[last][3]
+            if settle:
+                time.sleep(settle)
+            self._notify()
+            now = time.perf_counter()
+            self._train_time.observe(now - start)
+            for future, _, _, _, _ in items[finished:last + 1]:
+                future.set_result(now - start)
+            self._task_done(last + 1 - finished)
+            finished = last + 1
+            start = now
+
+        try:
+            self._notify()
+            self.gantry.runSequence([item[4] for item in items], done)
+        except BaseException as exc:
+            self.cancel_pending()
+            items[finished][0].set_exception(exc)
+            for future, _, _, _, _ in items[finished + 1:]:
+                future.set_exception(RuntimeError("Cancelled after an earlier move failed."))
+            self._task_done(len(items) - finished)
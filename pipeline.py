@@ -0,0 +1,374 @@
+# pipeline.py
+import functools
+import logging
+import queue
+import threading
+import time
+
+import cv2
+
+from config import (PIPELINE_QUEUE_SIZE, PIPELINE_CAPTURE_INTERVAL, PIPELINE_POLL_INTERVAL,
+                    PIPELINE_BATCH_WINDOW, SHOW_DETECTIONS, API_MAX_IN_FLIGHT)
+from metrics import metrics
+from planner import Job, assign_pads, plan_route
+
+log = logging.getLogger(__name__)
+
+
+class DropOldestQueue(queue.Queue):
+    """Bounded queue whose put() never blocks: when full, the oldest item is dropped."""
+
+    def __init__(self, maxsize=1):
+        super().__init__(maxsize)
+        self.dropped = 0
+
+    def put(self, item, block=True, timeout=None):
+        with self.not_full:
+            if 0 < self.maxsize <= self._qsize():
+                self._get()
+                self.unfinished_tasks -= 1
+                self.dropped += 1
+            self._put(item)
+            self.unfinished_tasks += 1
+            self.not_empty.notify()
+
+
+def image_slots(queue_size=PIPELINE_QUEUE_SIZE, in_flight=API_MAX_IN_FLIGHT):
+    """
+    Preprocessor ring size a ControlPipeline needs, so no table image is
+    overwritten while a stage still holds it: one per slot of the three
+    frame/detection queues, one per frame in detection, and the images in
+    the track, charge-monitor and capture stages and on their way to display.
+    """
+    return 3 * queue_size + in_flight + 5
+
+
+class ControlPipeline:
+    """
+    The controller as stages on their own threads, connected by bounded queues:
+
+        capture -+-> detect -> track --+-> plan -> actuate
+                 +-> charge monitor ---+
+
+    Frame queues keep only the newest frames and drop older ones, so a slow
+    stage (usually detection) never holds up the others and always works
+    on a recent frame. Detection keeps as many frames in flight as the
+    detector's client pipelines; results reach the tracker in frame order,
+    and one overtaken by a newer frame's is discarded. Delivered detections
+    and jobs are never dropped: their queues block the producer instead,
+    and the job queue is unbounded because each job carries a pad
+    reservation. Actuation is the MotionExecutor's worker; TableState is
+    updated from its callbacks as pad moves finish.
+
+    Nothing is copied per frame: capture renders the table image straight
+    from the grabber's ring, and every later stage, the change gate
+    included, works on that image. The preprocessor's ring must be large
+    enough that no image is reused while a stage still holds it; see
+    image_slots().
+    """
+
+    def __init__(self, grabber, preprocessor, detector, tracker, red_lights,
+                 executor, gantry, state, home=(0, 0), queue_size=PIPELINE_QUEUE_SIZE,
+                 capture_interval=PIPELINE_CAPTURE_INTERVAL, poll=PIPELINE_POLL_INTERVAL,
+                 batch_window=PIPELINE_BATCH_WINDOW, show=SHOW_DETECTIONS, name="pipeline"):
+        self.grabber = grabber
+        self.preprocessor = preprocessor
+        self.detector = detector
+        self.tracker = tracker
+        self.red_lights = red_lights
+        self.executor = executor
+        self.gantry = gantry
+        self.state = state
+        self.home = tuple(home)
+        self.capture_interval = capture_interval
+        self.poll = poll
+        self.batch_window = batch_window
+        self.show = show
+        self.name = name  # thread name prefix, to tell tables apart in the logs
+
+        slots = image_slots(queue_size, detector.client.max_in_flight)
+        if preprocessor.slots < slots:
+            raise ValueError(f"Preprocessor needs at least {slots} slots for this pipeline, "
+                             f"has {preprocessor.slots}.")
+
+        self.to_detect = DropOldestQueue(queue_size)    # capture -> detect
+        self.to_monitor = DropOldestQueue(queue_size)   # capture -> charge monitor
+        self.detections = queue.Queue(queue_size)       # detect -> track
+        self.jobs = queue.Queue()                       # track, charge monitor -> plan
+        self.display = DropOldestQueue(1)               # track -> main thread, if show
+
+        # Set by the tracker while a phone awaits confirmation
+        self.tentative = threading.Event()
+        self.stopped = threading.Event()
+        self.error = None
+        # Where the head will be once everything queued so far has run; a
+        # restored controller may not start at home
+        self.planned_position = (gantry.current_x, gantry.current_y)
+        self._frame_time = 0.0
+        # Frames with the detector at once, as many as its client pipelines
+        self._detect_slots = threading.Semaphore(detector.client.max_in_flight)
+        self._detected_lock = threading.Lock()
+        self._detected_time = 0.0
+        self._threads = []
+        # Unserved track IDs last logged, so waiting phones are reported once
+        self._reported = frozenset()
+
+        self._preprocess_time = metrics.timer("preprocess", "Rendering the table-space image")
+        self._dropped = metrics.counter("pipeline_dropped_frames_total",
+                                        "Frames replaced before a stage got to them")
+
+    def start(self):
+        stages = (
+            ("capture", self._capture),
+            ("detect", self._detect),
+            ("track", self._track),
+            ("charge-monitor", self._monitor),
+            ("plan", self._plan),
+        )
+        for name, step in stages:
+            thread = threading.Thread(target=self._loop, args=(step,),
+                                      name=f"{self.name}-{name}", daemon=True)
+            thread.start()
+            self._threads.append(thread)
+
+    def stop(self):
+        self.stopped.set()
+        for thread in self._threads:
+            thread.join()
+        self._threads = []
+
+    def fail(self, exc):
+        if self.error is None:
+            self.error = exc
+        self.stopped.set()
+
+    def run(self):
+        """
+        Start the stages and, with show, display detections on this thread
+        (OpenCV windows must stay on the main thread) until a stage fails or
+        we're interrupted. Overlays are only drawn for frames shown here.
+        """
+        self.start()
+        try:
+            while not self.stopped.is_set():
+                try:
+                    image, detections = self.display.get(timeout=self.poll)
+                except queue.Empty:
+                    continue
+                cv2.imshow('Final Detection', self.detector.annotate(image, detections))
+                cv2.waitKey(1)
+        finally:
+            self.stop()
+        if self.error is not None:
+            raise self.error
+
+    def _loop(self, step):
+        try:
+            while not self.stopped.is_set():
+                step()
+        except Exception as exc:
+            self.fail(exc)
+
+    def _get(self, source):
+        try:
+            return source.get(timeout=self.poll)
+        except queue.Empty:
+            return None
+
+    def _put(self, target, item):
+        # Blocking put that still notices shutdown
+        while not self.stopped.is_set():
+            try:
+                target.put(item, timeout=self.poll)
+                return
+            except queue.Full:
+                pass
+
+    ########################################
+    # Stages
+    ########################################
+    def _capture(self):
+        ret, frame, frame_time = self.grabber.read_newer(self._frame_time, timeout=self.poll)
+        if not ret:
+            return
+        self._frame_time = frame_time
+        # Rendered at once, before the grabber gets round to this ring slot again
+        with self._preprocess_time.time():
+            image = self.preprocessor.process(frame, key=frame_time)
+        dropped = self.to_detect.dropped + self.to_monitor.dropped
+        self.to_detect.put((frame_time, image))
+        self.to_monitor.put((frame_time, image))
+        self._dropped.inc(self.to_detect.dropped + self.to_monitor.dropped - dropped)
+        time.sleep(self.capture_interval)
+
+    def _detect(self):
+        # Take a frame only once a detection slot is free, so the one sent
+        # is the newest available rather than one that waited for the slot
+        if not self._detect_slots.acquire(timeout=self.poll):
+            return
+        item = self._get(self.to_detect)
+        if item is None:
+            self._detect_slots.release()
+            return
+        frame_time, image = item
+        # Bypass the change gate and the cache while a phone is still awaiting
+        # confirmation, so every confirming hit is a fresh detection
+        pending = self.detector.submit(key=frame_time, force=self.tentative.is_set(), image=image)
+        if pending is None:
+            self._detect_slots.release()
+            return
+        pending.add_done_callback(functools.partial(self._detected, frame_time))
+
+    def _detected(self, frame_time, future):
+        # Runs on a detection thread (or at once for gate skips and cache
+        # hits). The slot is held until the result, and with it the table
+        # image, has been handed on, so image_slots() can count on it.
+        try:
+            self._deliver(frame_time, future)
+        finally:
+            self._detect_slots.release()
+
+    def _deliver(self, frame_time, future):
+        try:
+            detected_frame, phones = future.result()
+        except Exception as exc:
+            self.fail(exc)
+            return
+        if detected_frame is not None and phones is None:
+            return  # overtaken by a newer frame's response
+        with self._detected_lock:
+            # Hand results on in frame order; one overtaken by a newer frame
+            # would only set the tracker back
+            if frame_time < self._detected_time:
+                return
+            self._detected_time = frame_time
+            self._put(self.detections, (frame_time, detected_frame, phones))
+
+    def _track(self):
+        item = self._get(self.detections)
+        if item is None:
+            return
+        frame_time, detected_frame, phones = item
+        if detected_frame is not None:
+            # Ignore phones that fall inside any occupied zone
+            candidates = [(px, py, conf) for (px, py, conf) in (phones or [])
+                          if not self.state.in_occupied_zone((px, py))]
+            # Confirmation builds up over successive analysed frames
+            self.tracker.update(candidates, frame_time)
+        if self.tracker.has_tentative:
+            self.tentative.set()
+        else:
+            self.tentative.clear()
+
+        # Only phones seen in this frame: a track coasting on its prediction
+        # may be a phone that has already been picked up
+        new_phones = self.state.unserved([t for t in self.tracker.confirmed() if t.misses == 0])
+        reported = frozenset(t.id for t in new_phones)
+        report = reported != self._reported
+        self._reported = reported
+        if not new_phones:
+            return
+        if self.show and detected_frame is not None:
+            self.display.put((detected_frame, phones))
+        if report:
+            log.info("Confirmed %d new phone(s).", len(new_phones))
+
+        # Match all new phones to the available pads at once, minimising
+        # total gantry time (out to the phone and back on retrieval)
+        available = self.state.available_pads()
+        assignment = assign_pads([t.position for t in new_phones],
+                                 [coords for _, coords in available],
+                                 self.gantry.travelTimes)
+        if len(assignment) < len(new_phones) and report:
+            log.warning("No available charging pads for %d phone(s). Skipping...",
+                        len(new_phones) - len(assignment))
+
+        for phone_i, available_i in assignment:
+            track = new_phones[phone_i]
+            px, py = track.position
+            pad_index, (cpx, cpy) = available[available_i]
+            # The pad is reserved and the zone occupied right away so the
+            # phone isn't served twice.
+            log.info("Delivering pad at (%d, %d) to phone %d at (%d, %d).", cpx, cpy, track.id, px, py)
+            self.state.reserve(track.id, pad_index, (px, py))
+            self.jobs.put(Job("place", (cpx, cpy), (px, py), track.id, pad_index))
+
+    def _monitor(self):
+        item = self._get(self.to_monitor)
+        if item is None:
+            return
+        _, image = item
+
+        # Watch exactly the pads that are sitting on phones
+        placed = self.state.placed()
+        for track_id in self.red_lights.states():
+            if track_id not in placed:
+                self.red_lights.unwatch(track_id)
+        for track_id, (position, _) in placed.items():
+            if track_id not in self.red_lights:
+                self.red_lights.watch(track_id, position)
+
+        # A pad counts as charged once its red light has been seen on
+        # consecutive frames
+        for track_id, charged in self.red_lights.update(image).items():
+            if not charged:
+                continue
+            retrieval = self.state.start_retrieval(track_id)
+            self.red_lights.unwatch(track_id)
+            if retrieval is None:
+                continue
+            (px, py), pad_index = retrieval
+            original_px, original_py = self.state.pad_coords(pad_index)
+            log.info("Retrieving pad at (%d,%d) back to (%d,%d).", px, py, original_px, original_py)
+            self.jobs.put(Job("retrieve", (px, py), (original_px, original_py), track_id, pad_index))
+
+    def _plan(self):
+        job = self._get(self.jobs)
+        if job is None:
+            if not self.executor.busy and self.planned_position != self.home:
+                # Go home only once there is nothing left to do
+                self.executor.goTo(*self.home)
+                self.planned_position = self.home
+            return
+
+        # Give jobs found around the same time a chance to join the batch
+        jobs = [job]
+        deadline = time.perf_counter() + self.batch_window
+        while True:
+            remaining = deadline - time.perf_counter()
+            if remaining <= 0:
+                break
+            try:
+                jobs.append(self.jobs.get(timeout=remaining))
+            except queue.Empty:
+                break
+
+        # Order the whole batch to minimise travel, continuing from
+        # wherever the already queued moves leave the head
+        route = plan_route(jobs, self.planned_position, self.gantry.travelTime, home=self.home)
+        moves = []
+        for job in route:
+            # Drive to the pad, pick it up, carry it over and set it down;
+            # explicit depths, so a Z left engaged can't invert the toggles
+            moves += [("xy", job.pickup), ("z", self.gantry.Z_PICK_DEPTH),
+                      ("xy", job.drop), ("z", self.gantry.Z_RETRACT_DEPTH)]
+        # Queued as one sequence so Z overlaps the XY moves around it
+        futures = self.executor.sequence(moves)
+        for job, done in zip(route, futures[3::4]):
+            done.add_done_callback(functools.partial(self._finished, job))
+            self.planned_position = job.drop
+
+    def _finished(self, job, future):
+        # Runs on the executor thread once a pad move is done
+        if future.cancelled():
+            if self.stopped.is_set():
+                return  # cancelled by our own shutdown
+            self.fail(RuntimeError(f"Pad move for phone {job.track_id} was cancelled."))
+            return
+        exc = future.exception()
+        if exc is not None:
+            self.fail(exc)
+        elif job.kind == "place":
+            self.state.mark_placed(job.track_id, job.pad_index)
+        else:
+            self.state.mark_returned(job.track_id, job.pad_index)
@@ -0,0 +1,134 @@
+# planner.py
+import itertools
+from collections import namedtuple
+
+import numpy as np
+
+try:
+    from scipy.optimize import linear_sum_assignment
+except ImportError:
+    linear_sum_assignment = None
+
+# kind: "place" (pad home -> phone) or "retrieve" (phone -> pad home).
+# The head carries one pad at a time, so a job always runs pickup -> drop.
+Job = namedtuple("Job", ["kind", "pickup", "drop", "track_id", "pad_index"])
+
+EXACT_LIMIT = 7  # up to 7! = 5040 orders are checked exhaustively
+
+
+def plan_route(jobs, start, cost, home=None, exact_limit=EXACT_LIMIT):
+    """
+    Order jobs to minimise total travel from `start`, finishing at `home`
+    when given (the head goes home once the batch is done). cost(p, q) is
+    the travel time between two points. Small batches are solved exactly;
+    larger ones use nearest-neighbour followed by 2-opt.
+    """
+    jobs = list(jobs)
+    if len(jobs) <= 1:
+        return jobs
+
+    # Only the empty legs (previous drop -> next pickup) depend on the order
+    n = len(jobs)
+    first = [cost(start, job.pickup) for job in jobs]
+    link = [[cost(a.drop, b.pickup) for b in jobs] for a in jobs]
+    last = [cost(job.drop, home) if home is not None else 0.0 for job in jobs]
+
+    def empty_travel(order):
+        total = first[order[0]] + last[order[-1]]
+        for a, b in zip(order, order[1:]):
+            total += link[a][b]
+        return total
+
+    if n <= exact_limit:
+        best = min(itertools.permutations(range(n)), key=empty_travel)
+        return [jobs[i] for i in best]
+
+    # Nearest neighbour from the start position
+    remaining = set(range(n))
+    current = min(remaining, key=lambda i: first[i])
+    order = [current]
+    remaining.remove(current)
+    while remaining:
+        current = min(remaining, key=lambda i: link[order[-1]][i])
+        order.append(current)
+        remaining.remove(current)
+
+    # 2-opt: reverse segments while that shortens the route. Links are
+    # asymmetric, so each candidate is re-costed in full.
+    best_cost = empty_travel(order)
+    improved = True
+    while improved:
+        improved = False
+        for i in range(n - 1):
+            for j in range(i + 1, n):
+                candidate = order[:i] + order[i:j + 1][::-1] + order[j + 1:]
+                candidate_cost = empty_travel(candidate)
+                if candidate_cost < best_cost - 1e-9:
+                    order, best_cost = candidate, candidate_cost
+                    improved = True
+    return [jobs[i] for i in order]
+
+
+def hungarian(cost):
+    """
+    Minimum-cost assignment for a rectangular cost matrix (O(n^2 m)
+    shortest augmenting paths). Returns (rows, cols) like
+    scipy.optimize.linear_sum_assignment.
+    """
+    cost = np.asarray(cost, dtype=np.float64)
+    transposed = cost.shape[0] > cost.shape[1]
+    if transposed:
+        cost = cost.T
+    n, m = cost.shape
+    u = np.zeros(n + 1)
+    v = np.zeros(m + 1)
+    match = np.zeros(m + 1, dtype=np.int64)  # match[col] = row (1-based), 0 = free
+    way = np.zeros(m + 1, dtype=np.int64)
+    for row in range(1, n + 1):
+        match[0] = row
+        col0 = 0
+        minv = np.full(m + 1, np.inf)
+        used = np.zeros(m + 1, dtype=bool)
+        while True:
+            used[col0] = True
+            row0 = match[col0]
+            free = ~used[1:]
+            reduced = cost[row0 - 1] - u[row0] - v[1:]
+            better = free & (reduced < minv[1:])
+            minv[1:][better] = reduced[better]
+            way[1:][better] = col0
+            candidates = np.where(free, minv[1:], np.inf)
+            col1 = int(np.argmin(candidates)) + 1
+            delta = candidates[col1 - 1]
+            u[match[used]] += delta
+            v[used] -= delta
+            minv[1:][free] -= delta
+            col0 = col1
+            if match[col0] == 0:
+                break
+        while col0:
+            col1 = way[col0]
+            match[col0] = match[col1]
+            col0 = col1
+    cols = np.nonzero(match[1:])[0]
+    rows = match[1:][cols] - 1
+    if transposed:
+        rows, cols = cols, rows
+    order = np.argsort(rows)
+    return rows[order], cols[order]
+
+
+def assign_pads(phones, pads, travel_times):
+    """
+    Match phones to available pads in one batch, minimising total gantry
+    time. travel_times(starts, ends) returns a (len(starts), len(ends))
+    matrix of seconds; a pad costs its trip out to the phone plus the trip
+    back home when it is retrieved. Returns [(phone_index, pad_index)];
+    with more phones than pads, the phones left out are simply absent.
+    """
+    if not phones or not pads:
+        return []
+    cost = travel_times(pads, phones).T + travel_times(phones, pads)
+    solve = linear_sum_assignment if linear_sum_assignment is not None else hungarian
+    rows, cols = solve(cost)
+    return [(int(r), int(c)) for r, c in zip(rows, cols)]
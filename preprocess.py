@@ -0,0 +1,108 @@
+# preprocess.py
+import threading
+
+import cv2
+import numpy as np
+
+from config import ROI_X1, ROI_Y1, ROI_X2, ROI_Y2, CAMERA_MATRIX, DIST_COEFFS
+
+
+class RoiPreprocessor:
+    """
+    Turns a camera frame into the canonical table-space image (ROI cropped,
+    rotated by `angle` degrees clockwise and, when calibration is
+    configured, undistorted) in one pass into a preallocated buffer.
+
+    Without calibration this is a single cv2.rotate of the ROI view; with
+    calibration the crop, rotation and undistortion are folded into one
+    precomputed cv2.remap table. Results are cached by key (e.g. the grab
+    timestamp), so phone and red-light detection share one image per
+    frame. Buffers are reused round-robin across `slots` frames: treat the
+    returned image as read-only and copy it if it must outlive that.
+    """
+
+    ROTATIONS = {
+        0: None,
+        90: cv2.ROTATE_90_CLOCKWISE,
+        180: cv2.ROTATE_180,
+        270: cv2.ROTATE_90_COUNTERCLOCKWISE,
+    }
+
+    def __init__(self, roi=(ROI_X1, ROI_Y1, ROI_X2, ROI_Y2), angle=90,
+                 camera_matrix=CAMERA_MATRIX, dist_coeffs=DIST_COEFFS, slots=4):
+        if angle not in self.ROTATIONS:
+            raise ValueError("Rotation must be a multiple of 90 degrees.")
+        self.x1, self.y1, self.x2, self.y2 = roi
+        self.angle = angle
+        roi_w = self.x2 - self.x1
+        roi_h = self.y2 - self.y1
+        if angle in (90, 270):
+            self.width, self.height = roi_h, roi_w
+        else:
+            self.width, self.height = roi_w, roi_h
+
+        self.maps = None
+        if camera_matrix is not None and dist_coeffs is not None:
+            self.maps = self._build_maps(np.asarray(camera_matrix, np.float64),
+                                         np.asarray(dist_coeffs, np.float64))
+
+        self.slots = slots
+        self._buffers = [None] * slots
+        self._next = 0
+        self._keys = [None] * slots
+        self._lock = threading.Lock()
+
+    def to_frame(self, x, y):
+        """Camera-frame pixel for table-space pixel (x, y), before undistortion; arrays work too."""
+        roi_w = self.x2 - self.x1
+        roi_h = self.y2 - self.y1
+        if self.angle == 90:
+            fx, fy = y, roi_h - 1 - x
+        elif self.angle == 180:
+            fx, fy = roi_w - 1 - x, roi_h - 1 - y
+        elif self.angle == 270:
+            fx, fy = roi_w - 1 - y, x
+        else:
+            fx, fy = x, y
+        return fx + self.x1, fy + self.y1
+
+    def _source_coords(self):
+        # Full-frame (x, y) sampled by every output pixel, before undistortion
+        rows, cols = np.indices((self.height, self.width), dtype=np.float32)
+        return self.to_frame(cols, rows)
+
+    def _build_maps(self, camera_matrix, dist_coeffs):
+        x, y = self._source_coords()
+        # Undistorted pixel -> distorted camera pixel, for exactly the pixels we sample
+        points = np.stack([x.ravel(), y.ravel()], axis=1).reshape(-1, 1, 2)
+        normalized = cv2.undistortPoints(points, camera_matrix, None)
+        object_points = cv2.convertPointsToHomogeneous(normalized).reshape(-1, 3)
+        distorted, _ = cv2.projectPoints(object_points, np.zeros(3), np.zeros(3),
+                                         camera_matrix, dist_coeffs)
+        distorted = distorted.reshape(self.height, self.width, 2).astype(np.float32)
+        return cv2.convertMaps(distorted, None, cv2.CV_16SC2)
+
+    def _render(self, frame, dst):
+        if self.maps is not None:
+            return cv2.remap(frame, self.maps[0], self.maps[1], cv2.INTER_LINEAR, dst=dst)
+        roi = frame[self.y1:self.y2, self.x1:self.x2]
+        code = self.ROTATIONS[self.angle]
+        if code is None:
+            np.copyto(dst, roi)
+            return dst
+        return cv2.rotate(roi, code, dst=dst)
+
+    def process(self, frame: np.ndarray, key=None) -> np.ndarray:
+        with self._lock:
+            if key is not None and key in self._keys:
+                return self._buffers[self._keys.index(key)]
+            index = self._next
+            self._next = (index + 1) % self.slots
+            shape = (self.height, self.width) + frame.shape[2:]
+            if self._buffers[index] is None or self._buffers[index].shape != shape:
+                self._buffers[index] = np.empty(shape, frame.dtype)
+            image = self._render(frame, self._buffers[index])
+            if image is not self._buffers[index]:
+                self._buffers[index] = image
+            self._keys[index] = key
+            return image
@@ -0,0 +1,104 @@
+# red_light.py
+import cv2
+import numpy as np
+
+from metrics import metrics
+from config import RED_LIGHT_THRESHOLD, RED_LIGHT_DEBOUNCE, RED_LIGHT_MIN_AREA
+
+# HSV ranges (OpenCV scale) counted as a pad's red "charged" light
+RED_HSV_RANGES = (
+    ((0, 100, 100), (10, 255, 255)),
+    ((160, 100, 100), (180, 255, 255)),
+)
+
+
+def build_red_lut(bits=6):
+    """
+    3D lookup table over quantized BGR: lut[b >> s, g >> s, r >> s] is 1
+    where the bin's centre falls inside RED_HSV_RANGES (s = 8 - bits).
+    """
+    levels = 1 << bits
+    step = 256 // levels
+    centres = (np.arange(levels) * step + step // 2).astype(np.uint8)
+    b, g, r = np.meshgrid(centres, centres, centres, indexing="ij")
+    bgr = np.stack([b, g, r], axis=-1).reshape(-1, 1, 3)
+    hsv = cv2.cvtColor(bgr, cv2.COLOR_BGR2HSV)
+    mask = np.zeros(hsv.shape[:2], np.uint8)
+    for lower, upper in RED_HSV_RANGES:
+        mask |= cv2.inRange(hsv, np.array(lower), np.array(upper))
+    return (mask.reshape(levels, levels, levels) > 0).astype(np.uint8) * 255
+
+
+class RedLightMonitor:
+    """
+    Watches only small windows around placed pads for their red light.
+
+    Each window is classified with a precomputed BGR lookup table instead
+    of an HSV conversion, cleaned with a 3x3 morphological open/close, and
+    counts as lit when a blob larger than
+    min_area has its centroid within radius of the pad. A pad's charged
+    state only flips after `debounce` consecutive frames agree.
+    """
+
+    def __init__(self, radius=RED_LIGHT_THRESHOLD, debounce=RED_LIGHT_DEBOUNCE,
+                 min_area=RED_LIGHT_MIN_AREA, lut_bits=6):
+        self.radius = radius
+        self.debounce = debounce
+        self.min_area = min_area
+        self.shift = 8 - lut_bits
+        self.lut = build_red_lut(lut_bits)
+        # Blobs centred inside the radius can extend past it
+        self.margin = radius + 10
+        self.kernel = np.ones((3, 3), np.uint8)
+        self._pads = {}
+        self._scan = metrics.timer("red_light_scan", "Checking every watched pad for its light")
+
+    def watch(self, key, center):
+        self._pads[key] = {"center": center, "charged": False, "streak": 0}
+
+    def unwatch(self, key):
+        self._pads.pop(key, None)
+
+    def __contains__(self, key):
+        return key in self._pads
+
+    def lit(self, image: np.ndarray, center) -> bool:
+        cx, cy = int(center[0]), int(center[1])
+        h, w = image.shape[:2]
+        x0, y0 = max(cx - self.margin, 0), max(cy - self.margin, 0)
+        x1, y1 = min(cx + self.margin + 1, w), min(cy + self.margin + 1, h)
+        if x0 >= x1 or y0 >= y1:
+            return False
+
+        window = image[y0:y1, x0:x1] >> self.shift
+        mask = self.lut[window[..., 0], window[..., 1], window[..., 2]]
+        if not mask.any():
+            return False
+        mask = cv2.morphologyEx(mask, cv2.MORPH_OPEN, self.kernel)
+        mask = cv2.morphologyEx(mask, cv2.MORPH_CLOSE, self.kernel)
+
+        count, _, stats, centroids = cv2.connectedComponentsWithStats(mask)
+        for i in range(1, count):
+            if stats[i, cv2.CC_STAT_AREA] <= self.min_area:
+                continue
+            bx, by = centroids[i]
+            if (bx + x0 - cx) ** 2 + (by + y0 - cy) ** 2 <= self.radius ** 2:
+                return True
+        return False
+
+    def update(self, image: np.ndarray):
+        """Analyse one table-space frame; returns {key: charged} for every watched pad."""
+        with self._scan.time():
+            for pad in self._pads.values():
+                lit = self.lit(image, pad["center"])
+                if lit == pad["charged"]:
+                    pad["streak"] = 0
+                else:
+                    pad["streak"] += 1
+                    if pad["streak"] >= self.debounce:
+                        pad["charged"] = lit
+                        pad["streak"] = 0
+        return self.states()
+
+    def states(self):
+        return {key: pad["charged"] for key, pad in self._pads.items()}
@@ -0,0 +1,220 @@
+# step_backends.py
+import time
+from collections import Counter, deque
+
+from config import STEP_BACKEND, PIGPIO_HOST, PIGPIO_PORT
+from motion import run_paced
+
+LOW = 0
+HIGH = 1
+
+
+class StepBackend:
+    """
+    Interface Gantry drives its motors through. A pulse train is a list of
+    (deadline_ns, pins, dirs) entries: at deadline_ns after the start of the
+    move, each (pin, level) in dirs is written, then each pin in pins is
+    pulled LOW and back HIGH (one step).
+    """
+
+    def setup(self, pins):
+        raise NotImplementedError
+
+    def write(self, pin, level):
+        raise NotImplementedError
+
+    def run(self, train):
+        raise NotImplementedError
+
+    def cleanup(self):
+        pass
+
+
+class GPIOStepBackend(StepBackend):
+    """Software stepping through RPi.GPIO, paced from the interpreter."""
+
+    def __init__(self):
+        import RPi.GPIO as GPIO
+        self.GPIO = GPIO
+
+    def setup(self, pins):
+        self.GPIO.setmode(self.GPIO.BCM)
+        for pin in pins:
+            self.GPIO.setup(pin, self.GPIO.OUT)
+
+    def write(self, pin, level):
+        self.GPIO.output(pin, level)
+
+    def run(self, train):
+        output = self.GPIO.output
+
+        def pulse(pins, dirs):
+            for pin, level in dirs:
+                output(pin, level)
+            for pin in pins:
+                output(pin, LOW)
+                output(pin, HIGH)
+
+        run_paced(train, pulse)
+
+    def cleanup(self):
+        self.GPIO.cleanup()
+
+
+class PigpioStepBackend(StepBackend):
+    """
+    Hardware-timed stepping through pigpio DMA waveforms. The pulse train is
+    streamed to the daemon in chunks, so the interpreter only wakes up to
+    queue the next one. pigpio chains one ONE_SHOT_SYNC wave behind the one
+    transmitting (a further send would replace it), so at most one wave is
+    pending: the next is sent once the transmitter has moved past the one
+    before it.
+    """
+
+    PULSE_WIDTH_US = 5
+    TICKS_PER_WAVE = 1000  # two pulses per tick; well inside pigpio's limits
+    POLL_INTERVAL = 0.002
+
+    def __init__(self, host=PIGPIO_HOST, port=PIGPIO_PORT):
+        import pigpio
+        self.pigpio = pigpio
+        self.pi = pigpio.pi(host, port)
+        if not self.pi.connected:
+            raise RuntimeError("Cannot connect to the pigpio daemon.")
+
+    def setup(self, pins):
+        for pin in pins:
+            self.pi.set_mode(pin, self.pigpio.OUTPUT)
+            self.pi.write(pin, HIGH)
+        self.pi.wave_clear()
+
+    def write(self, pin, level):
+        self.pi.write(pin, level)
+
+    def _wave_pulses(self, chunk, next_deadline):
+        pulse = self.pigpio.pulse
+        pulses = []
+        for i, (deadline, pins, dirs) in enumerate(chunk):
+            following = chunk[i + 1][0] if i + 1 < len(chunk) else next_deadline
+            gap_us = (following - deadline) // 1000
+            if dirs:
+                # Direction change gets its own pulse so the driver sees it
+                # settle before the step edge
+                dir_on = dir_off = 0
+                for pin, level in dirs:
+                    if level:
+                        dir_on |= 1 << pin
+                    else:
+                        dir_off |= 1 << pin
+                pulses.append(pulse(dir_on, dir_off, self.PULSE_WIDTH_US))
+                gap_us -= self.PULSE_WIDTH_US
+            mask = 0
+            for pin in pins:
+                mask |= 1 << pin
+            if mask:
+                pulses.append(pulse(0, mask, self.PULSE_WIDTH_US))
+                gap_us -= self.PULSE_WIDTH_US
+            pulses.append(pulse(mask, 0, max(gap_us, 1)))
+        return pulses
+
+    def run(self, train):
+        if not train:
+            return
+        pi = self.pi
+        pending = deque()
+        size = self.TICKS_PER_WAVE
+        for start in range(0, len(train), size):
+            chunk = train[start:start + size]
+            end = start + size
+            next_deadline = train[end][0] if end < len(train) else chunk[-1][0] + 1000 * (
+                self.PULSE_WIDTH_US + 1)
+            pi.wave_add_generic(self._wave_pulses(chunk, next_deadline))
+            wave_id = pi.wave_create()
+            if len(pending) == 2:
+                # One transmitting, one queued: wait for the first to finish
+                while pi.wave_tx_at() == pending[0]:
+                    time.sleep(self.POLL_INTERVAL)
+                pi.wave_delete(pending.popleft())
+            pi.wave_send_using_mode(wave_id, self.pigpio.WAVE_MODE_ONE_SHOT_SYNC)
+            pending.append(wave_id)
+        while pi.wave_tx_busy():
+            time.sleep(self.POLL_INTERVAL)
+        for wave_id in pending:
+            pi.wave_delete(wave_id)
+
+    def cleanup(self):
+        self.pi.wave_tx_stop()
+        self.pi.wave_clear()
+        self.pi.stop()
+
+
+class SimulatedStepBackend(StepBackend):
+    """
+    Pure-software backend for benchmarking and testing without a Pi.
+    Records every pulse as (timestamp_ns, pins). With realtime=False the
+    timestamps come from the train deadlines on a simulated clock and run()
+    returns immediately; with realtime=True moves are paced like the GPIO
+    backend and stamped with perf_counter_ns. time_scale (simulated clock
+    only) makes run() sleep for the move's duration times time_scale, so
+    callers see realistic motion timing without spinning on every pulse.
+    record_pulses=False keeps only step_counts and the clock, for long runs
+    where the pulse list would grow by millions of entries.
+    """
+
+    def __init__(self, realtime=False, time_scale=None, record_pulses=True):
+        self.realtime = realtime
+        self.time_scale = time_scale
+        self.record_pulses = record_pulses
+        self.levels = {}
+        self.pulses = []
+        self.step_counts = Counter()
+        self.clock_ns = 0
+
+    def setup(self, pins):
+        for pin in pins:
+            self.levels[pin] = HIGH
+
+    def write(self, pin, level):
+        self.levels[pin] = level
+
+    def run(self, train):
+        if not train:
+            return
+        if self.realtime:
+            clock = time.perf_counter_ns
+
+            def record(pins, dirs):
+                for pin, level in dirs:
+                    self.levels[pin] = level
+                if pins and self.record_pulses:
+                    self.pulses.append((clock(), pins))
+
+            run_paced(train, record)
+        else:
+            base = self.clock_ns
+            for deadline, pins, dirs in train:
+                for pin, level in dirs:
+                    self.levels[pin] = level
+                if pins and self.record_pulses:
+                    self.pulses.append((base + deadline, pins))
+            # Leave the clock one cruise-length gap past the last pulse
+            tail = train[-1][0] - train[-2][0] if len(train) > 1 else 0
+            self.clock_ns = base + train[-1][0] + tail
+            if self.time_scale:
+                time.sleep((self.clock_ns - base) / 1e9 * self.time_scale)
+        for _, pins, _ in train:
+            self.step_counts.update(pins)
+
+    def reset(self):
+        self.pulses.clear()
+        self.step_counts.clear()
+        self.clock_ns = 0
+
+
+def make_step_backend(name=STEP_BACKEND):
+    """The StepBackend named by a STEP_BACKEND setting."""
+    if name == "gpio":
+        return GPIOStepBackend()
+    if name == "pigpio":
+        return PigpioStepBackend()
+    raise ValueError(f"Unknown step backend: {name}")
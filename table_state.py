@@ -0,0 +1,135 @@
+# table_state.py
+import logging
+import math
+import threading
+
+from config import PAD_ZONE_RADIUS
+
+log = logging.getLogger(__name__)
+
+
+class TableState:
+    """
+    Charging pads, delivered pads and occupied zones, shared by the pipeline
+    stages and the motion executor's callbacks. Every method holds the lock,
+    so each call is one consistent step.
+
+    A pad's life: reserve() when a phone is matched to it (pad unavailable,
+    zone occupied), mark_placed() once it is on the phone, start_retrieval()
+    when its light says the phone is charged, and mark_returned() once it is
+    back home (pad available, zone freed).
+
+    With a journal.Journal, every step is also journalled, and restore()
+    rebuilds the state from a replayed journal after a restart.
+    """
+
+    def __init__(self, pad_coords, zone_radius=PAD_ZONE_RADIUS, journal=None):
+        self._lock = threading.RLock()
+        self.zone_radius = zone_radius
+        self.journal = journal
+        self.charging_pads = [{"coords": tuple(c), "available": True} for c in pad_coords]
+        # Where pads have been placed: {track_id: pad_index}
+        self.placed_pads = {}
+        # Occupied zones by the phone's track ID: {track_id: ((px, py), radius)}
+        self.occupied_zones = {}
+
+    def restore(self, pads, carrying=False):
+        """
+        Take over the pads of a replayed journal state. Jobs that were under
+        way are not resumed: a reservation that was never placed is dropped,
+        freeing its pad, and an unfinished retrieval counts as placed again
+        so the charge monitor retries it.
+
+        carrying: Z was engaged when the controller stopped, so one of the
+        pads under way was on the head and has been set down wherever it
+        stopped. Which one isn't known, so all of them stay out of service
+        (journalled as undelivered, to be freed by the next restart once
+        they are back home). Returns the highest track ID seen.
+        """
+        with self._lock:
+            last_id = 0
+            for track_id, pad in list(pads.items()):
+                last_id = max(last_id, track_id)
+                if pad["pad"] >= len(self.charging_pads):
+                    log.warning("Journal names unknown charging pad %d; ignored.", pad["pad"])
+                    continue
+                if carrying and pad["stage"] in ("reserved", "retrieving"):
+                    log.warning("Pad %d (phone %d) may have been on the head; out of service "
+                                "until it is put back home and the controller restarts.",
+                                pad["pad"], track_id)
+                    self.charging_pads[pad["pad"]]["available"] = False
+                    if pad["stage"] == "retrieving" and self.journal is not None:
+                        self.journal.reserve(track_id, pad["pad"], pad["position"])
+                    continue
+                if pad["stage"] == "reserved":
+                    log.warning("Pad %d was reserved for phone %d but never picked up; "
+                                "assuming it is home.", pad["pad"], track_id)
+                    if self.journal is not None:
+                        self.journal.returned(track_id)
+                    continue
+                if pad["stage"] == "retrieving" and self.journal is not None:
+                    self.journal.placed(track_id)
+                self.charging_pads[pad["pad"]]["available"] = False
+                self.occupied_zones[track_id] = (tuple(pad["position"]), self.zone_radius)
+                self.placed_pads[track_id] = pad["pad"]
+            return last_id
+
+    def pad_coords(self, pad_index):
+        return self.charging_pads[pad_index]["coords"]
+
+    def available_pads(self):
+        """[(pad_index, coords)] for pads that are home and free."""
+        with self._lock:
+            return [(i, p["coords"]) for i, p in enumerate(self.charging_pads) if p["available"]]
+
+    def in_occupied_zone(self, point):
+        with self._lock:
+            return any(math.hypot(point[0] - center[0], point[1] - center[1]) <= radius
+                       for center, radius in self.occupied_zones.values())
+
+    def unserved(self, tracks):
+        """The tracks that have no pad on the way or in place."""
+        with self._lock:
+            return [t for t in tracks if t.id not in self.occupied_zones]
+
+    def reserve(self, track_id, pad_index, position):
+        with self._lock:
+            pad = self.charging_pads[pad_index]
+            if not pad["available"]:
+                raise ValueError(f"Charging pad {pad_index} is not available.")
+            pad["available"] = False
+            self.occupied_zones[track_id] = (tuple(position), self.zone_radius)
+            if self.journal is not None:
+                self.journal.reserve(track_id, pad_index, position)
+
+    def mark_placed(self, track_id, pad_index):
+        with self._lock:
+            self.placed_pads[track_id] = pad_index
+            if self.journal is not None:
+                self.journal.placed(track_id)
+
+    def placed(self):
+        """{track_id: (phone_position, pad_index)} for pads sitting on phones."""
+        with self._lock:
+            return {track_id: (self.occupied_zones[track_id][0], pad_index)
+                    for track_id, pad_index in self.placed_pads.items()}
+
+    def start_retrieval(self, track_id):
+        """
+        Take a placed pad off the books; returns (phone_position, pad_index),
+        or None if it isn't placed. The zone stays occupied until it's back.
+        """
+        with self._lock:
+            pad_index = self.placed_pads.pop(track_id, None)
+            if pad_index is None:
+                return None
+            if self.journal is not None:
+                self.journal.retrieving(track_id)
+            return self.occupied_zones[track_id][0], pad_index
+
+    def mark_returned(self, track_id, pad_index):
+        with self._lock:
+            self.charging_pads[pad_index]["available"] = True
+            self.occupied_zones.pop(track_id, None)
+            if self.journal is not None:
+                self.journal.returned(track_id)
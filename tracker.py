@@ -0,0 +1,141 @@
+# tracker.py
+import itertools
+
+import numpy as np
+
+from config import (PIXEL_THRESHOLD, TRACK_CONFIRM_HITS, TRACK_MAX_MISSES,
+                    TRACK_PROCESS_NOISE, TRACK_MEASUREMENT_NOISE)
+
+
+class Track:
+    """One phone followed across detections with a constant-velocity Kalman filter."""
+
+    _ids = itertools.count(1)
+
+    def __init__(self, x, y, confidence, timestamp, measurement_noise):
+        self.id = next(self._ids)
+        self.state = np.array([x, y, 0.0, 0.0])  # x, y, vx, vy
+        self.covariance = np.diag([measurement_noise, measurement_noise, 1e4, 1e4])
+        self.confidence = confidence
+        self.timestamp = timestamp
+        self.hits = 1
+        self.misses = 0
+        self.confirmed = False
+
+    @property
+    def position(self):
+        return int(round(self.state[0])), int(round(self.state[1]))
+
+    def predict(self, timestamp, process_noise):
+        dt = max(timestamp - self.timestamp, 0.0)
+        if dt == 0.0:
+            return
+        F = np.eye(4)
+        F[0, 2] = F[1, 3] = dt
+        # White-acceleration noise for a constant-velocity model
+        q = process_noise
+        G = np.array([[dt * dt / 2, 0], [0, dt * dt / 2], [dt, 0], [0, dt]])
+        self.state = F @ self.state
+        self.covariance = F @ self.covariance @ F.T + q * (G @ G.T)
+        self.timestamp = timestamp
+
+    def correct(self, x, y, measurement_noise):
+        H = np.zeros((2, 4))
+        H[0, 0] = H[1, 1] = 1.0
+        S = H @ self.covariance @ H.T + np.eye(2) * measurement_noise
+        K = self.covariance @ H.T @ np.linalg.inv(S)
+        self.state = self.state + K @ (np.array([x, y]) - H @ self.state)
+        self.covariance = (np.eye(4) - K @ H) @ self.covariance
+
+
+class PhoneTracker:
+    """
+    Associates detected phone centres across frames. Each detection is
+    matched to the nearest predicted track within gate_distance; unmatched
+    detections start tentative tracks. A track is confirmed after
+    confirm_hits matched detections and dropped after max_misses frames
+    in a row without one.
+    """
+
+    def __init__(self, gate_distance=PIXEL_THRESHOLD, confirm_hits=TRACK_CONFIRM_HITS,
+                 max_misses=TRACK_MAX_MISSES, process_noise=TRACK_PROCESS_NOISE,
+                 measurement_noise=TRACK_MEASUREMENT_NOISE):
+        self.gate_distance = gate_distance
+        self.confirm_hits = confirm_hits
+        self.max_misses = max_misses
+        self.process_noise = process_noise
+        self.measurement_noise = measurement_noise
+        self.tracks = {}
+
+    @staticmethod
+    def skip_ids(last_id):
+        # New tracks must not reuse the IDs of phones restored from a journal;
+        # the counter is shared by every tracker, so it only moves forward
+        Track._ids = itertools.count(max(next(Track._ids), last_id + 1))
+
+    def associate(self, detections):
+        """Greedy nearest-first matching; returns [(track, detection_index)]."""
+        if not self.tracks or not detections:
+            return []
+        tracks = list(self.tracks.values())
+        predicted = np.array([t.state[:2] for t in tracks])
+        points = np.array([(d[0], d[1]) for d in detections], dtype=float)
+        dist = np.linalg.norm(predicted[:, None, :] - points[None, :, :], axis=2)
+        pairs = []
+        used_tracks, used_dets = set(), set()
+        for ti, di in zip(*np.unravel_index(np.argsort(dist, axis=None), dist.shape)):
+            if dist[ti, di] > self.gate_distance:
+                break
+            if ti in used_tracks or di in used_dets:
+                continue
+            used_tracks.add(ti)
+            used_dets.add(di)
+            pairs.append((tracks[ti], di))
+        return pairs
+
+    def update(self, detections, timestamp):
+        """
+        detections: [(center_x, center_y, confidence)] from one analysed frame.
+        Returns the confirmed tracks.
+        """
+        for track in self.tracks.values():
+            track.predict(timestamp, self.process_noise)
+
+        matched_tracks = set()
+        matched_detections = set()
+        for track, di in self.associate(detections):
+            x, y, confidence = detections[di]
+            track.correct(x, y, self.measurement_noise)
+            track.confidence = confidence
+            track.hits += 1
+            track.misses = 0
+            if track.hits >= self.confirm_hits:
+                track.confirmed = True
+            matched_tracks.add(track.id)
+            matched_detections.add(di)
+
+        for track_id, track in list(self.tracks.items()):
+            if track_id in matched_tracks:
+                continue
+            track.misses += 1
+            if track.misses >= self.max_misses:
+                del self.tracks[track_id]
+
+        for di, (x, y, confidence) in enumerate(detections):
+            if di in matched_detections:
+                continue
+            track = Track(x, y, confidence, timestamp, self.measurement_noise)
+            track.confirmed = self.confirm_hits <= 1
+            self.tracks[track.id] = track
+
+        return self.confirmed()
+
+    def confirmed(self):
+        return [t for t in self.tracks.values() if t.confirmed]
+
+    @property
+    def has_tentative(self):
+        return any(not t.confirmed for t in self.tracks.values())
+
+    def remove(self, track_id):
+        self.tracks.pop(track_id, None)